@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from db import shards
+
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "0") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_WAIT = float(os.getenv("WRITE_BATCH_WAIT", "0.005"))
+
+
+class WriteBatcher:
+    """
+        Coalesces concurrent writes into one transaction (group commit).
+
+        Rows passed to ``insert`` were validated by their callers and are written
+        together with a single flush. Jobs passed to ``submit`` run inside their own
+        SAVEPOINT on a shared session, so a failing job only fails its own caller.
+        The batch is committed once it holds ``max_batch`` entries or ``max_wait``
+        seconds after its first entry arrived.
+    """
+
+    def __init__(self, bind: Engine, max_batch: int = WRITE_BATCH_SIZE, max_wait: float = WRITE_BATCH_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # SQLite hands out max(id) + 1 itself but cannot return ids for a multi-row INSERT,
+        # so allocate them up front. Sharded engines already assign ids before each insert.
+        self._allocate_ids = bind.dialect.name == "sqlite" and not shards.is_sharded(bind)
+        self._session_factory = sessionmaker(bind=bind, autoflush=False, expire_on_commit=False)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[Session], Any]) -> Any:
+        """
+            Run ``job(session)`` in the next batch and return its result once committed.
+        """
+        future = Future()
+        self._queue.put((job, None, future))
+        return future.result()
+
+    def insert(self, row: Any) -> Any:
+        """
+            Insert the already validated ORM object ``row`` in the next batch and return it once committed.
+        """
+        future = Future()
+        self._queue.put((None, row, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    @staticmethod
+    def _assign_ids(session: Session, rows) -> list:
+        assigned = []
+        next_ids = {}
+        for row, _ in rows:
+            table = inspect(row).mapper.local_table
+            if row.id is not None:
+                continue
+            if table not in next_ids:
+                next_ids[table] = (session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+            row.id = next_ids[table]
+            next_ids[table] += 1
+            assigned.append(row)
+        return assigned
+
+    def _insert_rows(self, session: Session, rows) -> list:
+        assigned = []
+        try:
+            with session.begin_nested():
+                if self._allocate_ids:
+                    assigned = self._assign_ids(session, rows)
+                session.add_all([row for row, _ in rows])
+                session.flush()
+            return [(future, row) for row, future in rows]
+        except Exception:
+            for row in assigned:
+                row.id = None
+
+        # One bad row fails the shared INSERT; retry them one at a time so only it fails.
+        done = []
+        for row, future in rows:
+            try:
+                with session.begin_nested():
+                    session.add(row)
+                    session.flush()
+            except Exception as exc:
+                future.set_exception(exc)
+            else:
+                done.append((future, row))
+        return done
+
+    def _flush(self, batch):
+        session = self._session_factory()
+        rows = [(row, future) for job, row, future in batch if job is None]
+        jobs = [(job, future) for job, row, future in batch if job is not None]
+        done = []
+        try:
+            if rows:
+                done.extend(self._insert_rows(session, rows))
+            for job, future in jobs:
+                try:
+                    with session.begin_nested():
+                        result = job(session)
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    done.append((future, result))
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            for future, _ in done:
+                future.set_exception(exc)
+        else:
+            for future, result in done:
+                future.set_result(result)
+        finally:
+            session.close()
+
+
+_batchers: Dict[Engine, WriteBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(bind: Engine) -> WriteBatcher:
+    with _batchers_lock:
+        if bind not in _batchers:
+            _batchers[bind] = WriteBatcher(bind)
+        return _batchers[bind]
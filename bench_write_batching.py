@@ -0,0 +1,36 @@
+"""
+Compares node-creation latency and throughput with and without write batching.
+
+    python bench_write_batching.py --clients 1 8 32 --duration 10
+"""
+import argparse
+import sys
+
+from loadtest import run_load
+
+ENDPOINT = "POST /workflows/{id}/nodes/"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--batch-wait", default="0.005", help="WRITE_BATCH_WAIT in seconds")
+    parser.add_argument("--batch-size", default="64", help="WRITE_BATCH_SIZE")
+    args = parser.parse_args(argv)
+
+    print(f"{'clients':>8}{'batching':>10}{'req/s':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'err%':>8}")
+    for clients in args.clients:
+        for batching in ("0", "1"):
+            env = {"WRITE_BATCHING": batching, "WRITE_BATCH_WAIT": args.batch_wait, "WRITE_BATCH_SIZE": args.batch_size}
+            report = run_load(clients=clients, duration=args.duration, mix={"author": 1}, warmup_workflows=1, env=env)
+            row = report[ENDPOINT]
+            print(
+                f"{clients:>8}{'on' if batching == '1' else 'off':>10}{row['throughput']:>10.1f}"
+                f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}{row['error_rate']:>8.2%}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import rule_engine
+
+logger = logging.getLogger("workflow.conditions")
+
+CONDITION_POOL_SIZE = int(os.getenv("CONDITION_POOL_SIZE", "2"))
+CONDITION_TIMEOUT = float(os.getenv("CONDITION_TIMEOUT", "1.0"))
+CONDITION_MAX_COST = int(os.getenv("CONDITION_MAX_COST", "10000000"))
+CONDITION_SLOW_THRESHOLD = float(os.getenv("CONDITION_SLOW_THRESHOLD", "0.1"))
+
+RULE_CACHE_SIZE = 1024
+OUTCOME_CACHE_SIZE = int(os.getenv("CONDITION_OUTCOME_CACHE_SIZE", "4096"))
+SLOW_EXPRESSIONS_KEPT = 20
+
+
+class ConditionError(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class ConditionTimeout(ConditionError):
+    pass
+
+
+class ConditionTooExpensive(ConditionError):
+    pass
+
+
+@lru_cache(maxsize=RULE_CACHE_SIZE)
+def compile_rule(expression: str) -> rule_engine.Rule:
+    return rule_engine.Rule(expression)
+
+
+def _evaluate(expression: str, message: Optional[str]) -> Tuple[bool, bool]:
+    """
+        Evaluate a condition and report whether its compiled rule was already cached.
+    """
+    misses = compile_rule.cache_info().misses
+    try:
+        rule = compile_rule(expression)
+        cache_hit = compile_rule.cache_info().misses == misses
+        return bool(rule.evaluate({'message': message})), cache_hit
+    except rule_engine.errors.EngineError as exc:
+        # Raised in the worker as a ConditionError, which pickles cleanly back to the caller.
+        raise ConditionError(f"Invalid condition expression: {exc.message}")
+
+
+def _warm_up(_):
+    return None
+
+
+class ConditionEvaluator:
+    """
+        Evaluates user-supplied condition expressions in a bounded process pool.
+
+        Every evaluation has a deadline. A worker that misses it is abandoned
+        together with its pool: a replacement is spawned in the background while
+        the old pool's remaining workers keep serving, and the old pool is
+        terminated once the replacement is ready and its other in-flight
+        evaluations had time to finish. With ``pool_size=0`` conditions are
+        evaluated inline and only the cost limit applies.
+
+        Outcomes are cached by (expression, message), so an edited node never
+        hits a stale entry.
+    """
+
+    def __init__(self, pool_size: int = CONDITION_POOL_SIZE, timeout: float = CONDITION_TIMEOUT,
+                 max_cost: int = CONDITION_MAX_COST, slow_threshold: float = CONDITION_SLOW_THRESHOLD,
+                 outcome_cache_size: int = OUTCOME_CACHE_SIZE):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_cost = max_cost
+        self.slow_threshold = slow_threshold
+        self.outcome_cache_size = outcome_cache_size
+        self._pool = None
+        self._closed = False
+        # _lock guards counters, caches and the current pool and is never held while spawning;
+        # _spawn_lock makes sure only one pool is being spawned at a time.
+        self._lock = threading.Lock()
+        self._spawn_lock = threading.Lock()
+        self._outcomes = OrderedDict()
+        self._counters = {"evaluations": 0, "outcome_cache_hits": 0, "timeouts": 0, "rejected": 0, "slow": 0}
+        self._slow_expressions = deque(maxlen=SLOW_EXPRESSIONS_KEPT)
+
+    def _spawn_pool(self):
+        pool = multiprocessing.get_context("spawn").Pool(self.pool_size)
+        # Wait for the workers to start so start-up time never counts against a deadline.
+        pool.map(_warm_up, range(self.pool_size), chunksize=1)
+        return pool
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+        with self._spawn_lock:
+            with self._lock:
+                if self._pool is not None:
+                    return self._pool
+            pool = self._spawn_pool()
+            with self._lock:
+                self._pool = pool
+            return pool
+
+    def _replace_pool(self, stale):
+        """
+            Swap a freshly spawned pool in for ``stale``, then retire ``stale``.
+        """
+        with self._spawn_lock:
+            with self._lock:
+                if self._pool is not stale or self._closed:
+                    return
+            pool = self._spawn_pool()
+            with self._lock:
+                if self._closed:
+                    pool.terminate()
+                    return
+                self._pool = pool
+        stale.close()
+        timer = threading.Timer(self.timeout, stale.terminate)
+        timer.daemon = True
+        timer.start()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def evaluate(self, expression: str, message: Optional[str]) -> Tuple[bool, bool]:
+        """
+            Return the condition outcome and whether it or its compiled rule was cached.
+        """
+        key = (expression, message)
+        with self._lock:
+            if key in self._outcomes:
+                self._outcomes.move_to_end(key)
+                self._counters["outcome_cache_hits"] += 1
+                return self._outcomes[key], True
+
+        cost = len(expression) * max(len(message or ""), 1)
+        if cost > self.max_cost:
+            self._count("rejected")
+            raise ConditionTooExpensive("Condition evaluation exceeds the cost limit.")
+
+        self._count("evaluations")
+        started = time.perf_counter()
+        if self.pool_size <= 0:
+            result = _evaluate(expression, message)
+        else:
+            pool = self._get_pool()
+            try:
+                pending = pool.apply_async(_evaluate, (expression, message))
+            except ValueError:
+                # The pool was retired between _get_pool() and here; its replacement is ready.
+                pool = self._get_pool()
+                pending = pool.apply_async(_evaluate, (expression, message))
+            try:
+                result = pending.get(self.timeout)
+            except multiprocessing.TimeoutError:
+                self._count("timeouts")
+                threading.Thread(target=self._replace_pool, args=(pool,), name="condition-pool", daemon=True).start()
+                logger.warning("Condition evaluation timed out: %r", expression)
+                raise ConditionTimeout("Condition evaluation timed out.")
+
+        elapsed = time.perf_counter() - started
+        if elapsed > self.slow_threshold:
+            self._count("slow")
+            with self._lock:
+                self._slow_expressions.append({"expression": expression, "ms": elapsed * 1000})
+
+        outcome, cache_hit = result
+        with self._lock:
+            self._outcomes[key] = outcome
+            if len(self._outcomes) > self.outcome_cache_size:
+                self._outcomes.popitem(last=False)
+        return outcome, cache_hit
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._counters, "slow_expressions": list(self._slow_expressions)}
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+
+
+evaluator = ConditionEvaluator()
+atexit.register(evaluator.shutdown)
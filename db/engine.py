@@ -1,11 +1,85 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./workflow.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from db import shards
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./workflow.db")
+READ_POOL_SIZE = int(os.getenv("DATABASE_READ_POOL_SIZE", str(os.cpu_count() or 5)))
+
+
+def read_only_url(url: str) -> str:
+    """
+        Derive a read-only URL for a SQLite file database; other URLs are returned unchanged.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or parsed.database in (None, "", ":memory:"):
+        return url
+    if parsed.database.startswith("file:"):
+        return url
+    return f"sqlite:///file:{parsed.database}?mode=ro&uri=true"
+
+
+def enable_wal(engine):
+    """
+        Let SQLite readers proceed while a writer holds the database.
+    """
+    @event.listens_for(engine, "connect")
+    def set_journal_mode(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("DATABASE_READ_URL") or read_only_url(SQLALCHEMY_DATABASE_URL)
+
+
+def create_shard_engines() -> tuple:
+    """
+        Write and read-only engines for every shard, keyed by shard id.
+    """
+    write_engines, read_engines = {}, {}
+    for index, shard_id in enumerate(shards.all_shards()):
+        url = shards.shard_url(SQLALCHEMY_DATABASE_URL, index)
+        write_engines[shard_id] = create_engine(url, connect_args={"check_same_thread": False})
+        enable_wal(write_engines[shard_id])
+        shards.use_immediate_transactions(write_engines[shard_id])
+        read_engines[shard_id] = create_engine(
+            read_only_url(url), pool_size=READ_POOL_SIZE, connect_args={"check_same_thread": False}
+        )
+    return write_engines, read_engines
+
+
+if shards.SHARDED:
+    shard_engines, read_shard_engines = create_shard_engines()
+    engine, read_engine = shard_engines["0"], read_shard_engines["0"]
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, **shards.register_shards(shard_engines))
+    ReadSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, **shards.register_shards(read_shard_engines, writable=False)
+    )
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    )
+    if engine.dialect.name == "sqlite":
+        enable_wal(engine)
+        shards.use_immediate_transactions(engine)
+
+    if SQLALCHEMY_READ_DATABASE_URL == SQLALCHEMY_DATABASE_URL:
+        read_engine = engine
+    else:
+        read_engine = create_engine(
+            SQLALCHEMY_READ_DATABASE_URL,
+            pool_size=READ_POOL_SIZE,
+            **({"connect_args": {"check_same_thread": False}}
+               if make_url(SQLALCHEMY_READ_DATABASE_URL).get_backend_name() == "sqlite" else {})
+        )
+    shard_engines = {"0": engine}
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 Base = declarative_base()
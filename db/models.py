@@ -1,5 +1,5 @@
 from enum import Enum
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum as SQLAEnum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, LargeBinary, UniqueConstraint, Enum as SQLAEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import validates
@@ -36,13 +36,14 @@ class Workflow(Base):
 
     nodes = relationship("Node", back_populates="workflow")
     edges = relationship("Edge", back_populates="workflow")
+    versions = relationship("WorkflowVersion", back_populates="workflow")
 
 
 class Node(Base):
     __tablename__ = "node"
 
     id = Column(Integer, primary_key=True, index=True)
-    workflow_id = Column(Integer, ForeignKey('workflow.id'))
+    workflow_id = Column(Integer, ForeignKey('workflow.id'), index=True)
     type = Column(SQLAEnum(NodeType))
     status = Column(SQLAEnum(NodeStatus), nullable=True)
     message = Column(String, nullable=True)
@@ -59,9 +60,9 @@ class Edge(Base):
     __table_args__ = {'extend_existing': True}
 
     id = Column(Integer, primary_key=True, index=True)
-    workflow_id = Column(Integer, ForeignKey('workflow.id'))
-    start_node_id = Column(Integer, ForeignKey('node.id'))
-    end_node_id = Column(Integer, ForeignKey('node.id'))
+    workflow_id = Column(Integer, ForeignKey('workflow.id'), index=True)
+    start_node_id = Column(Integer, ForeignKey('node.id'), index=True)
+    end_node_id = Column(Integer, ForeignKey('node.id'), index=True)
     status = Column(String, nullable=True)
 
     workflow = relationship("Workflow", back_populates="edges")
@@ -69,3 +70,14 @@ class Edge(Base):
     end_node = relationship("Node", foreign_keys=[end_node_id], back_populates="incoming_edges")
 
 
+class WorkflowVersion(Base):
+    __tablename__ = "workflow_version"
+    __table_args__ = (UniqueConstraint('workflow_id', 'version'),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    workflow_id = Column(Integer, ForeignKey('workflow.id'), index=True)
+    version = Column(Integer, nullable=False)
+    graph = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    workflow = relationship("Workflow", back_populates="versions")
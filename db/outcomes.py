@@ -0,0 +1,56 @@
+"""
+One-time cleanup of condition outcomes stored before runs started trusting them.
+
+Databases written before outcomes were invalidated on edits can hold a stale
+``status`` on Message -> Condition edges. Clearing them makes the next run
+evaluate each condition again and store a fresh outcome:
+
+    python -m db.outcomes clear --shards 4
+"""
+import argparse
+import os
+import sys
+from typing import Iterable, Optional
+
+from sqlalchemy import create_engine, select, update
+
+from db import models
+from db.shards import WORKFLOW_SHARDS, shard_url
+
+
+def clear_stored_outcomes(database_url: str, shard_count: int = 1) -> int:
+    """
+        Clear ``status`` on every edge that ends at a Condition Node and return the number of edges cleared.
+    """
+    condition_nodes = select(models.Node.id).where(models.Node.type == models.NodeType.condition)
+    cleared = 0
+    for index in range(shard_count):
+        engine = create_engine(shard_url(database_url, index))
+        try:
+            with engine.begin() as conn:
+                result = conn.execute(
+                    update(models.Edge)
+                    .where(models.Edge.end_node_id.in_(condition_nodes), models.Edge.status.is_not(None))
+                    .values(status=None)
+                )
+                cleared += result.rowcount
+        finally:
+            engine.dispose()
+    return cleared
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    clear_parser = subcommands.add_parser("clear", help="clear stored outcomes on edges ending at Condition Nodes")
+    clear_parser.add_argument("--shards", type=int, default=WORKFLOW_SHARDS, help="current WORKFLOW_SHARDS value")
+    clear_parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./workflow.db"))
+    args = parser.parse_args(argv)
+
+    cleared = clear_stored_outcomes(args.database_url, args.shards)
+    print(f"Cleared {cleared} stored condition outcomes.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
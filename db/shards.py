@@ -0,0 +1,297 @@
+"""
+Workflow-sharded storage across several SQLite databases.
+
+Every workflow belongs to one of ``SHARD_SLOTS`` slots (``workflow_id % SHARD_SLOTS``)
+and slot ``s`` lives in shard ``s % WORKFLOW_SHARDS``. Nodes, edges and published
+versions are given ids congruent to their workflow's slot, so any id routes to a
+single database file. Shard 0 is the ``DATABASE_URL`` file itself, so an existing
+database can grow into a sharded one with the rebalance command:
+
+    python -m db.shards rebalance --from-shards 1 --to-shards 4
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import weakref
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, ColumnClause
+
+from db import models
+
+SHARD_SLOTS = 256
+WORKFLOW_SHARDS = int(os.getenv("WORKFLOW_SHARDS", "1"))
+SHARDED = WORKFLOW_SHARDS > 1
+
+ROUTING_COLUMNS = {
+    ("workflow", "id"),
+    ("node", "id"),
+    ("node", "workflow_id"),
+    ("edge", "id"),
+    ("edge", "workflow_id"),
+    ("edge", "start_node_id"),
+    ("edge", "end_node_id"),
+    ("workflow_version", "id"),
+    ("workflow_version", "workflow_id"),
+}
+
+_sharded_engines = weakref.WeakSet()
+
+
+def shard_url(url: str, index: int) -> str:
+    """
+        Database URL of shard ``index``; shard 0 is ``url`` itself.
+    """
+    if index == 0:
+        return url
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database or parsed.database == ":memory:":
+        raise ValueError("Sharding requires a file-based SQLite DATABASE_URL.")
+    root, ext = os.path.splitext(parsed.database)
+    return str(parsed.set(database=f"{root}.shard{index}{ext or '.db'}"))
+
+
+def slot_for(entity_id: int) -> int:
+    return entity_id % SHARD_SLOTS
+
+
+def shard_for(entity_id: int, shard_count: Optional[int] = None) -> str:
+    return str(slot_for(entity_id) % (shard_count or WORKFLOW_SHARDS))
+
+
+def all_shards(shard_count: Optional[int] = None) -> List[str]:
+    return [str(index) for index in range(shard_count or WORKFLOW_SHARDS)]
+
+
+def _workflow_slot(instance) -> int:
+    if isinstance(instance, models.Workflow):
+        if instance.id is not None:
+            return slot_for(instance.id)
+        if getattr(instance, "_shard_slot", None) is None:
+            instance._shard_slot = random.randrange(SHARD_SLOTS)
+        return instance._shard_slot
+    return slot_for(instance.workflow_id)
+
+
+def shard_chooser(mapper, instance, clause=None, **kw) -> str:
+    if instance is None:
+        raise ValueError("Cannot choose a shard without a mapped instance.")
+    return str(_workflow_slot(instance) % WORKFLOW_SHARDS)
+
+
+def identity_chooser(mapper, primary_key, **kw) -> List[str]:
+    return [shard_for(primary_key[0])]
+
+
+def _routing_values(statement) -> set:
+    values = set()
+    for element in visitors.iterate(statement):
+        if not isinstance(element, BinaryExpression) or element.operator not in (operators.eq, operators.in_op):
+            continue
+        column, param = element.left, element.right
+        if isinstance(column, BindParameter):
+            column, param = param, column
+        if not isinstance(column, ColumnClause) or not isinstance(param, BindParameter):
+            continue
+        table = getattr(column, "table", None)
+        if table is None or (table.name, column.name) not in ROUTING_COLUMNS:
+            continue
+        value = param.effective_value
+        values.update(value if isinstance(value, (list, tuple)) else [value])
+    values.discard(None)
+    return values
+
+
+def execute_chooser(context) -> List[str]:
+    """
+        Route a statement by the ids it filters on, or send it to every shard.
+    """
+    if context.is_select and context.lazy_loaded_from is not None \
+            and context.lazy_loaded_from.identity_token is not None:
+        return [context.lazy_loaded_from.identity_token]
+    values = _routing_values(context.statement)
+    if values:
+        return sorted({shard_for(value) for value in values})
+    return all_shards()
+
+
+def is_sharded(engine: Engine) -> bool:
+    return engine in _sharded_engines
+
+
+def next_id(connection, table, slot: int) -> int:
+    """
+        Allocate the next id in ``slot`` above every id already in this shard's ``table``.
+    """
+    transaction = connection.get_transaction()
+    allocated = connection.info.get("shard_allocated_ids")
+    if allocated is None or allocated[0] is not transaction:
+        allocated = (transaction, {})
+        connection.info["shard_allocated_ids"] = allocated
+
+    current = connection.execute(select(func.max(table.c.id))).scalar() or 0
+    current = max(current, allocated[1].get(table.name, 0))
+    new_id = (current // SHARD_SLOTS + 1) * SHARD_SLOTS + slot
+    allocated[1][table.name] = new_id
+    return new_id
+
+
+def _allocate_id(mapper, connection, target):
+    if target.id is None and connection.engine in _sharded_engines:
+        target.id = next_id(connection, mapper.local_table, _workflow_slot(target))
+
+
+for _model in (models.Workflow, models.Node, models.Edge, models.WorkflowVersion):
+    event.listen(_model, "before_insert", _allocate_id)
+
+
+def use_immediate_transactions(engine: Engine):
+    """
+        Let SQLAlchemy, not pysqlite, control SQLite transactions.
+
+        Each transaction starts with BEGIN IMMEDIATE, which takes the write lock up
+        front, so id allocation cannot race. pysqlite's own transaction handling is
+        turned off; otherwise a SAVEPOINT opened outside a transaction starts one,
+        and its RELEASE commits it.
+    """
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin_immediate(conn):
+        # Sent straight to the driver, like pysqlite's implicit BEGIN, so statement counts are unchanged.
+        conn.connection.driver_connection.execute("BEGIN IMMEDIATE")
+
+
+def register_shards(engines: Dict[str, Engine], writable: bool = True) -> dict:
+    """
+        Return ShardedSession keyword arguments for ``engines``.
+    """
+    if writable:
+        _sharded_engines.update(engines.values())
+    return {
+        "class_": ShardedSession,
+        "shards": engines,
+        "shard_chooser": shard_chooser,
+        "identity_chooser": identity_chooser,
+        "execute_chooser": execute_chooser,
+    }
+
+
+def _select_rows(conn, table, workflow_id: int) -> List[dict]:
+    column = table.c.id if table.name == "workflow" else table.c.workflow_id
+    return [dict(row._mapping) for row in conn.execute(select(table).where(column == workflow_id))]
+
+
+def _move_workflow(source, target, workflow_id: int, id_map: dict) -> bool:
+    """
+        Move one workflow into ``target``, renumbering rows whose ids are not in its slot.
+
+        Returns True when anything changed.
+    """
+    slot = slot_for(workflow_id)
+    tables = [models.Workflow.__table__, models.Node.__table__, models.Edge.__table__,
+              models.WorkflowVersion.__table__]
+    rows = {table.name: _select_rows(source, table, workflow_id) for table in tables}
+
+    misplaced = any(
+        slot_for(row["id"]) != slot for name in ("node", "edge", "workflow_version") for row in rows[name]
+    )
+    if source is target and not misplaced:
+        return False
+
+    if source is not target and target.execute(
+            select(models.Workflow.id).where(models.Workflow.id == workflow_id)).first():
+        raise RuntimeError(f"Workflow {workflow_id} already exists in the target shard.")
+
+    for table in reversed(tables):
+        column = table.c.id if table.name == "workflow" else table.c.workflow_id
+        source.execute(table.delete().where(column == workflow_id))
+
+    node_ids = {}
+    for row in rows["node"]:
+        new_id = row["id"]
+        if slot_for(new_id) != slot or target.execute(
+                select(models.Node.id).where(models.Node.id == new_id)).first():
+            new_id = next_id(target, models.Node.__table__, slot)
+            id_map.setdefault("node", {})[row["id"]] = new_id
+        node_ids[row["id"]] = new_id
+        row["id"] = new_id
+
+    for name in ("edge", "workflow_version"):
+        table = models.Edge.__table__ if name == "edge" else models.WorkflowVersion.__table__
+        for row in rows[name]:
+            if slot_for(row["id"]) != slot or target.execute(select(table.c.id).where(table.c.id == row["id"])).first():
+                new_id = next_id(target, table, slot)
+                id_map.setdefault(name, {})[row["id"]] = new_id
+                row["id"] = new_id
+            if name == "edge":
+                row["start_node_id"] = node_ids.get(row["start_node_id"], row["start_node_id"])
+                row["end_node_id"] = node_ids.get(row["end_node_id"], row["end_node_id"])
+
+    for table in tables:
+        if rows[table.name]:
+            target.execute(table.insert(), rows[table.name])
+    return True
+
+
+def rebalance(database_url: str, from_shards: int, to_shards: int) -> dict:
+    """
+        Move every workflow to shard ``slot % to_shards``. Run it with the service stopped.
+    """
+    urls = [shard_url(database_url, index) for index in range(max(from_shards, to_shards))]
+    engines = [create_engine(url) for url in urls]
+    for engine in engines:
+        models.Base.metadata.create_all(bind=engine)
+
+    moved, renumbered, id_map = 0, 0, {}
+    try:
+        for index in range(from_shards):
+            with engines[index].begin() as source:
+                workflow_ids = source.execute(select(models.Workflow.id).order_by(models.Workflow.id)).scalars().all()
+            for workflow_id in workflow_ids:
+                target_index = slot_for(workflow_id) % to_shards
+                with engines[index].begin() as source:
+                    if target_index == index:
+                        renumbered += _move_workflow(source, source, workflow_id, id_map)
+                        continue
+                    with engines[target_index].begin() as target:
+                        _move_workflow(source, target, workflow_id, id_map)
+                        moved += 1
+    finally:
+        for engine in engines:
+            engine.dispose()
+
+    return {"moved": moved, "renumbered": renumbered, "id_map": id_map}
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebalance_parser = subcommands.add_parser("rebalance", help="move workflows to match a new shard count")
+    rebalance_parser.add_argument("--from-shards", type=int, required=True, help="shard count the data was written with")
+    rebalance_parser.add_argument("--to-shards", type=int, required=True, help="new WORKFLOW_SHARDS value")
+    rebalance_parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./workflow.db"))
+    rebalance_parser.add_argument("--id-map", help="write renumbered node/edge/version ids as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.to_shards <= SHARD_SLOTS:
+        parser.error(f"--to-shards must be between 1 and {SHARD_SLOTS}")
+
+    result = rebalance(args.database_url, args.from_shards, args.to_shards)
+    print(f"Moved {result['moved']} workflows, renumbered {result['renumbered']} in place.")
+    if args.id_map:
+        with open(args.id_map, "w") as f:
+            json.dump(result["id_map"], f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,15 @@
 from fastapi import Depends
 from sqlalchemy.orm import Session
-from db.engine import SessionLocal
+from db.engine import ReadSessionLocal, SessionLocal
 
 
 class DBSession:
-    def __init__(self):
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
         self._session = None
 
     def __enter__(self):
-        self._session = SessionLocal()
+        self._session = self._session_factory()
         return self._session
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -17,4 +18,9 @@ class DBSession:
 
 def get_db() -> Session:
     with DBSession() as db:
-        yield db
\ No newline at end of file
+        yield db
+
+
+def get_read_db() -> Session:
+    with DBSession(ReadSessionLocal) as db:
+        yield db
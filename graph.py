@@ -0,0 +1,378 @@
+import itertools
+import json
+import os
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import networkx as nx
+from fastapi import HTTPException
+
+import conditions
+from schemas import NodeType, RunMode
+from tracing import NULL_TRACE
+
+RUN_PATH_LIMIT_MAX = int(os.getenv("RUN_PATH_LIMIT_MAX", "100"))
+RUN_PATH_OFFSET_MAX = int(os.getenv("RUN_PATH_OFFSET_MAX", "10000"))
+
+# Stand-ins joining every Start Node and every End Node, so one search covers all of them.
+VIRTUAL_SOURCE = ("source",)
+VIRTUAL_SINK = ("sink",)
+
+
+def workflow_rows(workflow) -> Tuple[List[list], List[list]]:
+    """
+        Flatten a workflow's nodes and edges into plain rows.
+    """
+    nodes = [
+        [node.id, node.type, node.status, node.message, node.condition_expression]
+        for node in workflow.nodes
+    ]
+    edges = [
+        [edge.id, edge.start_node_id, edge.end_node_id, edge.status]
+        for edge in workflow.edges
+    ]
+    return nodes, edges
+
+
+def dump_snapshot(workflow) -> bytes:
+    """
+        Serialize a workflow graph into a compact, compressed blob.
+    """
+    nodes, edges = workflow_rows(workflow)
+    payload = json.dumps({"nodes": nodes, "edges": edges}, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"))
+
+
+def load_snapshot(blob: bytes) -> Tuple[List[list], List[list]]:
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return payload["nodes"], payload["edges"]
+
+
+def build_graph(nodes: Iterable[list], edges: Iterable[list]) -> nx.DiGraph:
+    G = nx.DiGraph()
+
+    for node_id, node_type, status, message, condition_expression in nodes:
+        G.add_node(
+            node_id,
+            type=NodeType(node_type),
+            status=status,
+            message=message,
+            condition_expression=condition_expression,
+        )
+
+    for edge_id, start_node_id, end_node_id, status in edges:
+        G.add_edge(start_node_id, end_node_id, id=edge_id, status=status)
+
+    return G
+
+
+def find_shortest_path(G: nx.DiGraph, start_nodes: List[int], end_nodes: List[int]) -> Optional[List[int]]:
+    shortest_path = None
+    shortest_length = float('inf')
+
+    for start_node in start_nodes:
+        for end_node in end_nodes:
+            try:
+                path = nx.shortest_path(G, source=start_node, target=end_node)
+            except nx.NetworkXNoPath:
+                continue
+            if len(path) < shortest_length:
+                shortest_length = len(path)
+                shortest_path = path
+
+    return shortest_path
+
+
+def find_last_message_node(G: nx.DiGraph, node_id: int, visited: Optional[set] = None) -> Optional[int]:
+    """
+        Walk incoming edges back to the closest Message Node, passing through Condition Nodes.
+    """
+    visited = set() if visited is None else visited
+    visited.add(node_id)
+
+    incoming = sorted(G.in_edges(node_id, data="id"), key=lambda edge: edge[2])
+    for start_node_id, _, _ in incoming:
+        start_type = G.nodes[start_node_id]["type"]
+
+        if start_type == NodeType.message:
+            return start_node_id
+
+        if start_type == NodeType.condition and start_node_id not in visited:
+            message_node_id = find_last_message_node(G, start_node_id, visited)
+            if message_node_id is not None:
+                return message_node_id
+
+    return None
+
+
+def find_endpoints(G: nx.DiGraph) -> Tuple[List[int], List[int], Optional[str]]:
+    """
+        Return the Start and End Nodes, or an error message when either is missing.
+    """
+    start_nodes = [node_id for node_id, node_type in G.nodes(data="type") if node_type == NodeType.start]
+    end_nodes = [node_id for node_id, node_type in G.nodes(data="type") if node_type == NodeType.end]
+
+    if not start_nodes:
+        return start_nodes, end_nodes, "No start node found"
+    if not end_nodes:
+        return start_nodes, end_nodes, "No end node found"
+    return start_nodes, end_nodes, None
+
+
+def resolve_shortest_path(G: nx.DiGraph) -> Tuple[Optional[List[int]], Optional[str]]:
+    """
+        Return the shortest start-to-end path, or an error message when there is none.
+    """
+    start_nodes, end_nodes, error = find_endpoints(G)
+    if error:
+        return None, error
+
+    shortest_path = find_shortest_path(G, start_nodes, end_nodes)
+    if not shortest_path:
+        return None, "No path found from start to end node"
+    return shortest_path, None
+
+
+def iter_paths(G: nx.DiGraph, mode: RunMode, max_depth: Optional[int] = None) -> Iterator[List[int]]:
+    """
+        Lazily enumerate simple start-to-end paths of at most ``max_depth`` nodes.
+
+        ``k_shortest`` yields paths in order of length (Yen's algorithm), ``all_paths``
+        in depth-first order. Nothing beyond the path being yielded is materialized.
+    """
+    start_nodes, end_nodes, error = find_endpoints(G)
+    if error:
+        return
+
+    H = nx.DiGraph()
+    H.add_edges_from(G.edges)
+    H.add_edges_from((VIRTUAL_SOURCE, node_id) for node_id in start_nodes)
+    H.add_edges_from((node_id, VIRTUAL_SINK) for node_id in end_nodes)
+
+    if mode == RunMode.k_shortest:
+        paths = nx.shortest_simple_paths(H, VIRTUAL_SOURCE, VIRTUAL_SINK)
+    else:
+        # The cutoff counts edges, and the virtual endpoints add one edge to every path.
+        cutoff = None if max_depth is None else max_depth + 1
+        paths = nx.all_simple_paths(H, VIRTUAL_SOURCE, VIRTUAL_SINK, cutoff=cutoff)
+
+    try:
+        for path in paths:
+            path = path[1:-1]
+            if max_depth is not None and len(path) > max_depth:
+                # Only k_shortest gets here; every later path is at least as long.
+                return
+            yield path
+    except nx.NetworkXNoPath:
+        return
+
+
+def check_path_page(limit: int, offset: int, max_depth: Optional[int]):
+    if not 1 <= limit <= RUN_PATH_LIMIT_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {RUN_PATH_LIMIT_MAX}.")
+    if not 0 <= offset <= RUN_PATH_OFFSET_MAX:
+        raise HTTPException(status_code=400, detail=f"offset must be between 0 and {RUN_PATH_OFFSET_MAX}.")
+    if max_depth is not None and max_depth < 1:
+        raise HTTPException(status_code=400, detail="max_depth must be at least 1.")
+
+
+def _traced(iterator: Iterator, trace, name: str) -> Iterator:
+    iterator = iter(iterator)
+    while True:
+        with trace.phase(name):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+
+def stored_outcome(G: nx.DiGraph, message_node_id: int, condition_node_id: int) -> Optional[str]:
+    """
+        Return the outcome persisted on the Message -> Condition edge, if it is still valid.
+    """
+    if not G.has_edge(message_node_id, condition_node_id):
+        return None
+    status = G.edges[message_node_id, condition_node_id]["status"]
+    return status if status in ("Yes", "No") else None
+
+
+def changed_outcomes(G: nx.DiGraph, outcomes: Dict[Tuple[int, int], str]) -> Dict[int, Tuple[str, str, str]]:
+    """
+        Map edge id to (outcome, message, expression) for every outcome that differs from the
+        stored edge status; the message and expression are the inputs it was evaluated from.
+    """
+    return {
+        G.edges[pair]["id"]: (status, G.nodes[pair[0]]["message"], G.nodes[pair[1]]["condition_expression"])
+        for pair, status in outcomes.items()
+        if G.has_edge(*pair) and G.edges[pair]["status"] != status
+    }
+
+
+def iter_path_steps(G: nx.DiGraph, path: Iterable[int], trace=NULL_TRACE) -> Iterator[Tuple[dict, Optional[tuple]]]:
+    """
+        Yield each step of ``path`` as soon as it is resolved.
+
+        Condition Nodes are evaluated against their last Message Node, and the step is
+        paired with a ``(message node id, condition node id, outcome)`` tuple.
+    """
+    for node_id in path:
+        node = G.nodes[node_id]
+        outcome = None
+
+        if node["type"] == NodeType.condition:
+            with trace.phase("find_last_message_node"):
+                message_node_id = find_last_message_node(G, node_id)
+            if message_node_id is None:
+                raise HTTPException(status_code=400, detail="Condition Node must have a preceding Message Node.")
+
+            started = time.perf_counter()
+            stored = stored_outcome(G, message_node_id, node_id)
+            if stored is not None:
+                outcome, rule_cache = (message_node_id, node_id, stored), "stored"
+            else:
+                with trace.phase("rule_evaluation"):
+                    try:
+                        result, cache_hit = conditions.evaluator.evaluate(
+                            node["condition_expression"], G.nodes[message_node_id]["message"]
+                        )
+                    except conditions.ConditionError as exc:
+                        raise HTTPException(status_code=400, detail=exc.detail)
+                outcome, rule_cache = (message_node_id, node_id, "Yes" if result else "No"), "hit" if cache_hit else "miss"
+
+            if trace.enabled:
+                trace.condition(
+                    node_id=node_id,
+                    message_node_id=message_node_id,
+                    outcome=outcome[2],
+                    ms=(time.perf_counter() - started) * 1000,
+                    rule_cache=rule_cache,
+                )
+
+        yield {
+            "id": node_id,
+            "type": node["type"],
+            "status": node["status"],
+            "message": node["message"]
+        }, outcome
+
+
+def run_graph(G: nx.DiGraph, trace=NULL_TRACE) -> Tuple[dict, Dict[Tuple[int, int], str]]:
+    """
+        Find the shortest path from a start node to an end node and evaluate its conditions.
+
+        Returns the response payload and the condition outcome for every
+        (message node, condition node) pair met on the path.
+    """
+    with trace.phase("shortest_path"):
+        shortest_path, error = resolve_shortest_path(G)
+    if error:
+        return {"error": error}, {}
+
+    detailed_path = []
+    outcomes = {}
+    for step, outcome in iter_path_steps(G, shortest_path, trace=trace):
+        if outcome is not None:
+            message_node_id, node_id, status = outcome
+            outcomes[(message_node_id, node_id)] = status
+        detailed_path.append(step)
+
+    return {"path": detailed_path}, outcomes
+
+
+def _iter_resolved_steps(G: nx.DiGraph, path: List[int], resolved: dict, trace=NULL_TRACE) -> Iterator[tuple]:
+    """
+        Like iter_path_steps, but reuse steps already resolved for an earlier path.
+    """
+    pending = iter_path_steps(G, [node_id for node_id in path if node_id not in resolved], trace=trace)
+    for node_id in path:
+        if node_id not in resolved:
+            resolved[node_id] = next(pending)
+        yield resolved[node_id]
+
+
+def run_paths(G: nx.DiGraph, mode: RunMode, limit: int, offset: int = 0, max_depth: Optional[int] = None,
+              trace=NULL_TRACE) -> Tuple[dict, Dict[Tuple[int, int], str]]:
+    """
+        Evaluate one page of the paths enumerated by ``mode``.
+
+        One path past the page is enumerated to tell whether more exist.
+    """
+    _, _, error = find_endpoints(G)
+    if error:
+        return {"error": error}, {}
+
+    page = itertools.islice(_traced(iter_paths(G, mode, max_depth), trace, "path_search"), offset, offset + limit + 1)
+    detailed_paths = []
+    outcomes = {}
+    resolved = {}
+    has_more = False
+    for path in page:
+        if len(detailed_paths) == limit:
+            has_more = True
+            break
+        detailed_path = []
+        for step, outcome in _iter_resolved_steps(G, path, resolved, trace=trace):
+            if outcome is not None:
+                message_node_id, node_id, status = outcome
+                outcomes[(message_node_id, node_id)] = status
+            detailed_path.append(step)
+        detailed_paths.append(detailed_path)
+
+    if not detailed_paths and offset == 0:
+        return {"error": "No path found from start to end node"}, {}
+    return {"mode": mode, "offset": offset, "limit": limit, "has_more": has_more, "paths": detailed_paths}, outcomes
+
+
+def iter_run_events(G: nx.DiGraph, mode: RunMode = RunMode.shortest, limit: int = 1, offset: int = 0,
+                    max_depth: Optional[int] = None) -> Iterator[dict]:
+    """
+        Yield run progress events: one ``step`` per resolved node, then ``end`` or ``error``.
+
+        Path modes other than ``shortest`` announce each path with a ``path`` event first.
+    """
+    if mode != RunMode.shortest:
+        yield from _iter_path_events(G, mode, limit, offset, max_depth)
+        return
+
+    shortest_path, error = resolve_shortest_path(G)
+    if error:
+        yield {"event": "error", "error": error}
+        return
+
+    steps = 0
+    try:
+        for step, outcome in iter_path_steps(G, shortest_path):
+            steps += 1
+            yield {"event": "step", **step, "condition": outcome[2] if outcome else None}
+    except HTTPException as exc:
+        yield {"event": "error", "error": exc.detail}
+        return
+
+    yield {"event": "end", "steps": steps}
+
+
+def _iter_path_events(G: nx.DiGraph, mode: RunMode, limit: int, offset: int,
+                      max_depth: Optional[int]) -> Iterator[dict]:
+    _, _, error = find_endpoints(G)
+    if error:
+        yield {"event": "error", "error": error}
+        return
+
+    paths = steps = 0
+    resolved = {}
+    try:
+        for index, path in enumerate(itertools.islice(iter_paths(G, mode, max_depth), offset, offset + limit), offset):
+            paths += 1
+            yield {"event": "path", "index": index, "length": len(path)}
+            for step, outcome in _iter_resolved_steps(G, path, resolved):
+                steps += 1
+                yield {"event": "step", **step, "path": index, "condition": outcome[2] if outcome else None}
+    except HTTPException as exc:
+        yield {"event": "error", "error": exc.detail}
+        return
+
+    if not paths and offset == 0:
+        yield {"event": "error", "error": "No path found from start to end node"}
+        return
+    yield {"event": "end", "paths": paths, "steps": steps}
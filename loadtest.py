@@ -0,0 +1,335 @@
+"""
+Concurrent load generator for the workflow service.
+
+Starts the app with uvicorn against a scratch SQLite database, drives a
+weighted mix of CRUD, run and list traffic from N concurrent async clients
+and reports latency percentiles, throughput and error rates per endpoint.
+
+    python loadtest.py --clients 32 --duration 30 --mix crud=4,run=3,list=3
+    python loadtest.py --save-baseline baseline.json
+    python loadtest.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import create_engine
+
+from db.models import Base
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = {"crud": 4, "run": 3, "list": 3}
+TRAFFIC_KINDS = ("crud", "run", "list", "author")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """
+        Nearest-rank percentile of ``samples``.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in TRAFFIC_KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown traffic kind '{name}'")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, elapsed: float, ok: bool):
+        self.latencies[endpoint].append(elapsed)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, duration: float) -> Dict[str, dict]:
+        report = {}
+        all_latencies = []
+        for endpoint, samples in sorted(self.latencies.items()):
+            all_latencies.extend(samples)
+            report[endpoint] = self._summary(samples, self.errors[endpoint], duration)
+        report["total"] = self._summary(all_latencies, sum(self.errors.values()), duration)
+        return report
+
+    @staticmethod
+    def _summary(samples: List[float], errors: int, duration: float) -> dict:
+        return {
+            "requests": len(samples),
+            "errors": errors,
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "throughput": len(samples) / duration if duration else 0.0,
+            "p50": percentile(samples, 50) * 1000,
+            "p95": percentile(samples, 95) * 1000,
+            "p99": percentile(samples, 99) * 1000,
+        }
+
+
+def compare_to_baseline(report: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+        Return a description of every metric that regressed beyond ``tolerance``.
+    """
+    regressions = []
+    for endpoint, expected in baseline.items():
+        actual = report.get(endpoint)
+        if actual is None:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            if actual[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{endpoint} {metric}: {actual[metric]:.1f}ms > baseline {expected[metric]:.1f}ms"
+                )
+        if actual["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint} throughput: {actual['throughput']:.1f}/s < baseline {expected['throughput']:.1f}/s"
+            )
+        if actual["error_rate"] > expected["error_rate"] + 0.01:
+            regressions.append(
+                f"{endpoint} error rate: {actual['error_rate']:.2%} > baseline {expected['error_rate']:.2%}"
+            )
+    return regressions
+
+
+def print_report(report: Dict[str, dict]):
+    header = f"{'endpoint':<38}{'reqs':>8}{'err%':>8}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in report.items():
+        print(
+            f"{endpoint:<38}{row['requests']:>8}{row['error_rate']:>8.2%}{row['throughput']:>9.1f}"
+            f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}"
+        )
+
+
+class Server:
+    """
+        Runs ``uvicorn main:app`` in a subprocess against a scratch database.
+    """
+
+    def __init__(self, env: Optional[Dict[str, str]] = None):
+        self.env = env or {}
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_url = f"sqlite:///{os.path.join(self.tmpdir.name, 'loadtest.db')}"
+        self.port = self._free_port()
+        self.process = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def __enter__(self):
+        engine = create_engine(self.database_url)
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+
+        env = dict(os.environ, DATABASE_URL=self.database_url, **self.env)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            cwd=ROOT,
+            env=env,
+        )
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(self.base_url + "/", timeout=1)
+                return self
+            except httpx.TransportError:
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("Server did not start")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        self.tmpdir.cleanup()
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, int], seed: int):
+        self.client = client
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.random = random.Random(seed)
+        self.recorder = Recorder()
+        self.workflows = []
+        self.message_nodes = []
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, time.perf_counter() - started, False)
+            return None
+        ok = response.status_code < 400 and not response.text.startswith('{"error"')
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return response
+
+    async def create_runnable_workflow(self) -> Optional[int]:
+        response = await self.request("POST /workflows/", "POST", "/workflows/", json={"name": "load"})
+        if response is None or response.status_code != 200:
+            return None
+        workflow_id = response.json()["id"]
+
+        node_ids = []
+        for node in ({"type": "Start"}, {"type": "Message", "message": "hello"}, {"type": "End"}):
+            response = await self.request(
+                "POST /workflows/{id}/nodes/", "POST", f"/workflows/{workflow_id}/nodes/", json=node
+            )
+            if response is None or response.status_code != 200:
+                return None
+            node_ids.append(response.json()["id"])
+
+        for start_node_id, end_node_id in zip(node_ids, node_ids[1:]):
+            await self.request(
+                "POST /workflows/{id}/edges/", "POST", f"/workflows/{workflow_id}/edges/",
+                json={"start_node_id": start_node_id, "end_node_id": end_node_id},
+            )
+
+        self.workflows.append(workflow_id)
+        self.message_nodes.append(node_ids[1])
+        return workflow_id
+
+    async def crud_traffic(self):
+        choice = self.random.random()
+        if choice < 0.25 or not self.workflows:
+            await self.create_runnable_workflow()
+        elif choice < 0.5:
+            workflow_id = self.random.choice(self.workflows)
+            await self.request("GET /workflows/{id}/", "GET", f"/workflows/{workflow_id}/")
+        elif choice < 0.75:
+            node_id = self.random.choice(self.message_nodes)
+            await self.request("GET /nodes/{id}/", "GET", f"/nodes/{node_id}/")
+        else:
+            node_id = self.random.choice(self.message_nodes)
+            await self.request(
+                "PUT /nodes/{id}/", "PUT", f"/nodes/{node_id}/",
+                json={"type": "Message", "message": f"hello {self.random.random()}"},
+            )
+
+    async def author_traffic(self):
+        if not self.workflows:
+            await self.create_runnable_workflow()
+            return
+        workflow_id = self.random.choice(self.workflows)
+        await self.request(
+            "POST /workflows/{id}/nodes/", "POST", f"/workflows/{workflow_id}/nodes/",
+            json={"type": "Message", "message": "authored"},
+        )
+
+    async def run_traffic(self):
+        if not self.workflows:
+            await self.create_runnable_workflow()
+            return
+        workflow_id = self.random.choice(self.workflows)
+        await self.request("POST /workflows/{id}/run/", "POST", f"/workflows/{workflow_id}/run/")
+
+    async def list_traffic(self):
+        endpoint = self.random.choice(["/workflows/", "/nodes/", "/edges/"])
+        await self.request(f"GET {endpoint}", "GET", endpoint)
+
+    async def client_loop(self, stop_at: float):
+        while time.monotonic() < stop_at:
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            await getattr(self, f"{kind}_traffic")()
+
+
+async def drive(base_url: str, clients: int, duration: float, mix: Dict[str, int], seed: int,
+                warmup_workflows: int) -> Dict[str, dict]:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        seeder = LoadGenerator(client, mix, seed)
+        for _ in range(warmup_workflows):
+            await seeder.create_runnable_workflow()
+
+        generators = []
+        for index in range(clients):
+            generator = LoadGenerator(client, mix, seed + index + 1)
+            generator.workflows = list(seeder.workflows)
+            generator.message_nodes = list(seeder.message_nodes)
+            generators.append(generator)
+
+        started = time.monotonic()
+        await asyncio.gather(*(g.client_loop(started + duration) for g in generators))
+        elapsed = time.monotonic() - started
+
+    recorder = Recorder()
+    for generator in generators:
+        for endpoint, samples in generator.recorder.latencies.items():
+            recorder.latencies[endpoint].extend(samples)
+        for endpoint, errors in generator.recorder.errors.items():
+            recorder.errors[endpoint] += errors
+    return recorder.report(elapsed)
+
+
+def run_load(clients: int = 16, duration: float = 10, mix: Optional[Dict[str, int]] = None, seed: int = 0,
+             warmup_workflows: int = 10, env: Optional[Dict[str, str]] = None) -> Dict[str, dict]:
+    with Server(env=env) as server:
+        return asyncio.run(drive(server.base_url, clients, duration, mix or DEFAULT_MIX, seed, warmup_workflows))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic to generate")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights of crud, run, list and author traffic, e.g. crud=4,run=3,list=3")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup-workflows", type=int, default=10, help="runnable workflows created up front")
+    parser.add_argument("--json", dest="json_path", help="write the report as JSON to this path")
+    parser.add_argument("--save-baseline", help="store the report as a baseline at this path")
+    parser.add_argument("--baseline", help="fail when the report regresses against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    report = run_load(args.clients, args.duration, args.mix, args.seed, args.warmup_workflows)
+    print_report(report)
+
+    for path in filter(None, (args.json_path, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
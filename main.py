@@ -1,18 +1,19 @@
-import networkx as nx
-import rule_engine
-from fastapi import FastAPI, Depends, APIRouter, HTTPException
+import json
+
+from fastapi import FastAPI, Depends, APIRouter, HTTPException, Request
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from typing_extensions import Union
 
 
-from db import models
 from typing import List
+import conditions
 import schemas
-from db.models import NodeType
+import singleflight
 from dependencies import get_db
 from schemas import WorkflowCreate
 from services import WorkflowService
+from tracing import start_trace
 
 app = FastAPI()
 
@@ -22,6 +23,14 @@ def root():
     return {"message": "Hello World"}
 
 
+@app.get("/metrics/")
+def get_metrics():
+    """
+        Retrieve in-process service counters.
+    """
+    return {"conditions": conditions.evaluator.metrics(), "runs": singleflight.runs.metrics()}
+
+
 @app.get("/hello/{name}")
 def say_hello(name: str):
     return {"message": f"Hello {name}"}
@@ -57,6 +66,49 @@ def create_workflow(workflow: schemas.WorkflowCreate, workflow_service: Workflow
     return workflow_service.create_workflow(workflow=workflow)
 
 
+@app.delete("/workflows/{workflow_id}/")
+def delete_workflow(workflow_id: int, workflow_service: WorkflowService = Depends()):
+    """
+        Delete a workflow together with its nodes, edges and published versions.
+    """
+    workflow_service.delete_workflow(workflow_id)
+    return JSONResponse(content={"message": "Workflow successfully deleted"})
+
+
+@app.post("/workflows/{workflow_id}/clone", response_model=schemas.Workflow)
+def clone_workflow(workflow_id: int, workflow_service: WorkflowService = Depends()):
+    """
+        Clone a workflow together with its nodes and edges.
+    """
+    db_workflow = workflow_service.clone_workflow(workflow_id=workflow_id)
+
+    if db_workflow is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+
+    return db_workflow
+
+
+@app.post("/workflows/{workflow_id}/publish", response_model=schemas.WorkflowVersion)
+def publish_workflow(workflow_id: int, workflow_service: WorkflowService = Depends()):
+    """
+        Freeze the current state of a workflow into a new immutable version.
+    """
+    db_version = workflow_service.publish_workflow(workflow_id=workflow_id)
+
+    if db_version is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+
+    return db_version
+
+
+@app.get("/workflows/{workflow_id}/versions/", response_model=List[schemas.WorkflowVersion])
+def get_workflow_versions(workflow_id: int, workflow_service: WorkflowService = Depends()):
+    """
+        Retrieve all published versions of a workflow.
+    """
+    return workflow_service.get_workflow_versions(workflow_id=workflow_id)
+
+
 @app.post("/workflows/{workflow_id}/nodes/", response_model=schemas.Node)
 def create_node(workflow_id: int, node: schemas.NodeCreate, node_service: WorkflowService = Depends()):
     """
@@ -99,7 +151,7 @@ def delete_node(node_id: int, node_service: WorkflowService = Depends()):
     """
         Delete a node by its ID.
     """
-    node_service.delete_edge(node_id)
+    node_service.delete_node(node_id)
     return JSONResponse(content={"message": "Node successfully deleted"})
 
 
@@ -147,79 +199,58 @@ def delete_edge(edge_id: int, edge_service: WorkflowService = Depends()):
 
 
 @app.post("/workflows/{workflow_id}/run/")
-def run_workflow(workflow_id: int, workflow_service: WorkflowService = Depends()):
+def run_workflow(
+        workflow_id: int,
+        version: Union[int, None] = None,
+        trace: bool = False,
+        mode: schemas.RunMode = schemas.RunMode.shortest,
+        limit: int = 10,
+        offset: int = 0,
+        max_depth: Union[int, None] = None,
+        workflow_service: WorkflowService = Depends()
+):
     """
         Execute a workflow and find the shortest path from a start node to an end node.
+
+        Pass ``version`` to run a published snapshot instead of the current draft,
+        and ``trace=true`` to include per-phase timings and SQL counts in the response.
+        ``mode=k_shortest`` returns alternative paths shortest first and ``mode=all_paths``
+        every simple path, paginated with ``limit``/``offset`` and bounded by ``max_depth`` nodes.
     """
-    workflow = workflow_service.get_workflow(workflow_id)
-    G = nx.DiGraph()
-
-    for node in workflow.nodes:
-        G.add_node(node.id, type=node.type, status=node.status, message=node.message)
-
-    for edge in workflow.edges:
-        G.add_edge(edge.start_node_id, edge.end_node_id, status=edge.status)
-
-    start_nodes = [node.id for node in workflow.nodes if node.type == NodeType.start]
-    end_nodes = [node.id for node in workflow.nodes if node.type == NodeType.end]
-
-    if not start_nodes:
-        return {"error": "No start node found"}
-    if not end_nodes:
-        return {"error": "No end node found"}
-
-    try:
-        shortest_path = None
-        shortest_length = float('inf')
-
-        for start_node in start_nodes:
-            for end_node in end_nodes:
-                try:
-                    path = nx.shortest_path(G, source=start_node, target=end_node)
-                    path_length = len(path)
-                    if path_length < shortest_length:
-                        shortest_length = path_length
-                        shortest_path = path
-                except nx.NetworkXNoPath:
-                    continue
-
-        if not shortest_path:
-            return {"error": "No path found from start to end node"}
-
-        detailed_path = []
-        for node_id in shortest_path:
-            node = workflow_service.get_node(node_id)
-
-            if node.type == NodeType.condition:
-                last_message_node = workflow_service.find_last_message_node(node)
-                if not last_message_node:
-                    raise HTTPException(status_code=400, detail="Condition Node must have a preceding Message Node.")
-
-                condition = node.condition_expression
-                context = {'message': last_message_node.message}
-                rule = rule_engine.Rule(condition)
-
-                if rule.evaluate(context):
-                    edge = workflow_service.db.query(models.Edge).filter(
-                        models.Edge.start_node_id == last_message_node.id,
-                        models.Edge.end_node_id == node.id
-                    ).first()
-                    edge.status = "Yes"
-                else:
-                    edge = workflow_service.db.query(models.Edge).filter(
-                        models.Edge.start_node_id == last_message_node.id,
-                        models.Edge.end_node_id == node.id
-                    ).first()
-                    edge.status = "No"
-
-            detailed_path.append({
-                "id": node.id,
-                "type": node.type,
-                "status": node.status,
-                "message": node.message
-            })
-
-        return {"path": detailed_path}
-    except nx.NetworkXNoPath:
-        return {"error": "No path found from start to end node"}
+    run_trace = start_trace(requested=trace)
+    result = workflow_service.run_workflow(workflow_id, version=version, trace=run_trace, mode=mode,
+                                           limit=limit, offset=offset, max_depth=max_depth)
+
+    if run_trace.sampled:
+        run_trace.log(workflow_id)
+    if trace:
+        result["trace"] = run_trace.as_dict()
+    return result
+
+
+@app.post("/workflows/{workflow_id}/run/stream")
+def stream_workflow(
+        workflow_id: int,
+        request: Request,
+        version: Union[int, None] = None,
+        mode: schemas.RunMode = schemas.RunMode.shortest,
+        limit: int = 10,
+        offset: int = 0,
+        max_depth: Union[int, None] = None,
+        workflow_service: WorkflowService = Depends()
+):
+    """
+        Execute a workflow and stream each path step as soon as it is resolved.
+
+        Responds with Server-Sent Events when the client accepts ``text/event-stream``,
+        otherwise with newline-delimited JSON. Path modes are the same as for ``run``.
+    """
+    events = workflow_service.stream_workflow(workflow_id, version=version, mode=mode, limit=limit,
+                                              offset=offset, max_depth=max_depth)
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        body = (f"event: {event['event']}\ndata: {json.dumps(event)}\n\n" for event in events)
+        return StreamingResponse(body, media_type="text/event-stream")
 
+    body = (json.dumps(event) + "\n" for event in events)
+    return StreamingResponse(body, media_type="application/x-ndjson")
@@ -12,6 +12,12 @@ class NodeType(str, Enum):
     end = 'End'
 
 
+class RunMode(str, Enum):
+    shortest = 'shortest'
+    k_shortest = 'k_shortest'
+    all_paths = 'all_paths'
+
+
 class NodeStatus(str, Enum):
     pending = 'pending'
     sent = 'sent'
@@ -76,4 +82,14 @@ class Workflow(WorkflowBase):
     edges: List['Edge'] = []
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class WorkflowVersion(BaseModel):
+    id: int
+    workflow_id: int
+    version: int
+    created_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
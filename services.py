@@ -1,27 +1,94 @@
-from typing import List
-import rule_engine
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+import networkx as nx
 from fastapi import Depends, HTTPException
+from sqlalchemy import and_, case, delete, exists, func, insert, literal, or_, select, update
 
+import batching
+import conditions
 import schemas
-from db import models
-from sqlalchemy.orm import Session
-from schemas import WorkflowCreate, NodeCreate, EdgeCreate, NodeType
-from dependencies import get_db
+import singleflight
+from db import models, shards
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, selectinload
+from schemas import WorkflowCreate, NodeCreate, EdgeCreate, NodeType, RunMode
+from dependencies import get_db, get_read_db
+from graph import (
+    build_graph, changed_outcomes, check_path_page, dump_snapshot, iter_run_events, load_snapshot, run_graph, run_paths, workflow_rows
+)
+from tracing import NULL_TRACE
+
+PUBLISHED_GRAPH_CACHE_SIZE = 256
+PUBLISH_ATTEMPTS = 3
+EDGE_WRITE_ATTEMPTS = 3
+
+# Published versions never change, so their graphs can be kept for the life of the process.
+_published_graphs = OrderedDict()
+_published_graphs_lock = threading.Lock()
+
+
+def clear_published_graph_cache(workflow_id: Optional[int] = None):
+    with _published_graphs_lock:
+        if workflow_id is None:
+            _published_graphs.clear()
+            return
+        for key in [key for key in _published_graphs if key[0] == workflow_id]:
+            del _published_graphs[key]
+
+
+# Bumped after every committed change to a draft graph, so coalesced runs never span an edit.
+_draft_revisions: Dict[int, int] = {}
+_draft_revisions_lock = threading.Lock()
+
+
+def draft_revision(workflow_id: int) -> int:
+    with _draft_revisions_lock:
+        return _draft_revisions.get(workflow_id, 0)
+
+
+def bump_draft_revision(workflow_id: int):
+    with _draft_revisions_lock:
+        _draft_revisions[workflow_id] = _draft_revisions.get(workflow_id, 0) + 1
+
+
+class ConditionInputsChanged(Exception):
+    """
+        A node's message or expression changed after its condition was evaluated.
+    """
 
 
 class WorkflowService:
-    def __init__(self, db: Session = Depends(get_db)):
+    def __init__(self, db: Session = Depends(get_db), read_db: Session = Depends(get_read_db)):
         self.db = db
+        self.read_db = read_db
+
+    @staticmethod
+    def _list_by_id(query, model, skip: int, limit: int) -> list:
+        if not shards.SHARDED:
+            return query.offset(skip).limit(limit).all()
+        # Every shard returns its first skip + limit rows; merging them by id gives the global page.
+        rows = query.order_by(model.id).limit(skip + limit).all()
+        return sorted(rows, key=lambda row: row.id)[skip:skip + limit]
+
+    def _write_bind(self, workflow_id: int):
+        if shards.SHARDED:
+            return self.db.get_bind(shard_id=shards.shard_for(workflow_id))
+        return self.db.get_bind()
 
     def get_all_workflow(
             self,
             skip: int = 0,
             limit: int = 100,
     ) -> List[models.Workflow]:
-        return self.db.query(models.Workflow).offset(skip).limit(limit).all()
+        query = self.read_db.query(models.Workflow).options(
+            selectinload(models.Workflow.nodes),
+            selectinload(models.Workflow.edges),
+        )
+        return self._list_by_id(query, models.Workflow, skip, limit)
 
     def get_workflow(self, workflow_id: int):
-        return self.db.query(models.Workflow).filter(models.Workflow.id == workflow_id).first()
+        return self.read_db.query(models.Workflow).filter(models.Workflow.id == workflow_id).first()
 
     def create_workflow(self, workflow: WorkflowCreate):
         db_workflow = models.Workflow(name=workflow.name)
@@ -30,13 +97,321 @@ class WorkflowService:
         self.db.refresh(db_workflow)
         return db_workflow
 
+    def clone_workflow(self, workflow_id: int) -> Optional[models.Workflow]:
+        # Copied rows get explicit ids picked under SQLite's database-wide write lock. Elsewhere
+        # that would race with concurrent clones and leave id sequences behind the copied rows.
+        if not shards.SHARDED and self.db.get_bind().dialect.name != "sqlite":
+            raise HTTPException(status_code=501, detail="Cloning is only supported on SQLite databases.")
+
+        source = self.read_db.get(models.Workflow, workflow_id)
+        if source is None:
+            return None
+
+        # Like any new workflow, the copy gets a random slot when sharded, so the
+        # clones of a popular template spread over every shard.
+        db_workflow = models.Workflow(name=source.name)
+        self.db.add(db_workflow)
+        # Flushing first takes the SQLite write lock, so the id range picked
+        # below cannot be claimed by a concurrent writer before we commit.
+        self.db.flush()
+
+        source_shard = {"shard_id": shards.shard_for(workflow_id)} if shards.SHARDED else None
+        target_shard = {"shard_id": shards.shard_for(db_workflow.id)} if shards.SHARDED else None
+        # Sharded ids must stay congruent to their workflow's slot.
+        slot_shift = (shards.slot_for(db_workflow.id) - shards.slot_for(workflow_id)) % shards.SHARD_SLOTS \
+            if shards.SHARDED else 0
+        if source_shard == target_shard:
+            self._clone_rows(workflow_id, db_workflow.id, target_shard, slot_shift)
+        else:
+            self._copy_rows(workflow_id, db_workflow.id, source_shard, target_shard, slot_shift)
+
+        self.db.commit()
+        self.db.refresh(db_workflow)
+        return db_workflow
+
+    @staticmethod
+    def _clone_offset(min_id: int, max_id: Optional[int], slot_shift: int) -> int:
+        """
+            Return the amount to add to ids starting at ``min_id`` to move them above ``max_id``
+            while shifting them by ``slot_shift`` slots.
+        """
+        stride = shards.SHARD_SLOTS if shards.SHARDED else 1
+        return ((max_id or 0) - min_id) // stride * stride + stride + slot_shift
+
+    def _clone_rows(self, workflow_id: int, new_workflow_id: int, shard: Optional[dict], slot_shift: int):
+        """
+            Copy the nodes and edges of ``workflow_id`` with INSERT...SELECT inside one database.
+        """
+        min_node_id, min_edge_id = self.db.execute(select(
+            select(func.min(models.Node.id)).where(models.Node.workflow_id == workflow_id).scalar_subquery(),
+            select(func.min(models.Edge.id)).where(models.Edge.workflow_id == workflow_id).scalar_subquery(),
+        ), bind_arguments=shard).one()
+        if min_node_id is None:
+            return
+
+        max_node_id, max_edge_id = self.db.execute(select(
+            select(func.max(models.Node.id)).scalar_subquery(),
+            select(func.max(models.Edge.id)).scalar_subquery(),
+        ), bind_arguments=shard).one()
+        node_offset = self._clone_offset(min_node_id, max_node_id, slot_shift)
+        edge_offset = self._clone_offset(min_edge_id, max_edge_id, slot_shift) if min_edge_id is not None else 0
+
+        self.db.execute(insert(models.Node).from_select(
+            ["id", "workflow_id", "type", "status", "message", "condition_text", "condition_expression"],
+            select(
+                models.Node.id + node_offset,
+                literal(new_workflow_id),
+                models.Node.type,
+                models.Node.status,
+                models.Node.message,
+                models.Node.condition_text,
+                models.Node.condition_expression,
+            ).where(models.Node.workflow_id == workflow_id)
+        ), bind_arguments=shard)
+        self.db.execute(insert(models.Edge).from_select(
+            ["id", "workflow_id", "start_node_id", "end_node_id", "status"],
+            select(
+                models.Edge.id + edge_offset,
+                literal(new_workflow_id),
+                models.Edge.start_node_id + node_offset,
+                models.Edge.end_node_id + node_offset,
+                models.Edge.status,
+            ).where(models.Edge.workflow_id == workflow_id)
+        ), bind_arguments=shard)
+
+    def _copy_rows(self, workflow_id: int, new_workflow_id: int, source_shard: dict, target_shard: dict,
+                   slot_shift: int):
+        """
+            Copy the nodes and edges of ``workflow_id`` to another shard with one executemany per table.
+        """
+        node_table, edge_table = models.Node.__table__, models.Edge.__table__
+        nodes = self.read_db.execute(
+            select(node_table).where(node_table.c.workflow_id == workflow_id), bind_arguments=source_shard
+        ).mappings().all()
+        if not nodes:
+            return
+        edges = self.read_db.execute(
+            select(edge_table).where(edge_table.c.workflow_id == workflow_id), bind_arguments=source_shard
+        ).mappings().all()
+
+        max_node_id, max_edge_id = self.db.execute(select(
+            select(func.max(models.Node.id)).scalar_subquery(),
+            select(func.max(models.Edge.id)).scalar_subquery(),
+        ), bind_arguments=target_shard).one()
+        node_offset = self._clone_offset(min(node["id"] for node in nodes), max_node_id, slot_shift)
+
+        self.db.execute(insert(node_table), [
+            dict(node, id=node["id"] + node_offset, workflow_id=new_workflow_id) for node in nodes
+        ], bind_arguments=target_shard)
+        if edges:
+            edge_offset = self._clone_offset(min(edge["id"] for edge in edges), max_edge_id, slot_shift)
+            self.db.execute(insert(edge_table), [
+                dict(
+                    edge,
+                    id=edge["id"] + edge_offset,
+                    workflow_id=new_workflow_id,
+                    start_node_id=edge["start_node_id"] + node_offset,
+                    end_node_id=edge["end_node_id"] + node_offset,
+                ) for edge in edges
+            ], bind_arguments=target_shard)
+
+    def delete_workflow(self, workflow_id: int):
+        existing = self.db.query(models.Workflow.id).filter(models.Workflow.id == workflow_id).scalar()
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Workflow not found")
+
+        self.db.execute(delete(models.Edge).where(models.Edge.workflow_id == workflow_id))
+        self.db.execute(delete(models.Node).where(models.Node.workflow_id == workflow_id))
+        self.db.execute(delete(models.WorkflowVersion).where(models.WorkflowVersion.workflow_id == workflow_id))
+        self.db.execute(delete(models.Workflow).where(models.Workflow.id == workflow_id))
+        self.db.commit()
+        bump_draft_revision(workflow_id)
+        clear_published_graph_cache(workflow_id)
+
+    def publish_workflow(self, workflow_id: int) -> Optional[models.WorkflowVersion]:
+        # On SQLite the write transaction starts with BEGIN IMMEDIATE, so the max(version)
+        # read below already holds the write lock. Other databases can still race, and the
+        # loser sees the (workflow_id, version) unique constraint; it retries with a new number.
+        for _ in range(PUBLISH_ATTEMPTS):
+            workflow = self.db.get(models.Workflow, workflow_id)
+            if workflow is None:
+                return None
+
+            latest_version = self.db.query(func.max(models.WorkflowVersion.version)).filter(
+                models.WorkflowVersion.workflow_id == workflow_id
+            ).scalar()
+
+            db_version = models.WorkflowVersion(
+                workflow_id=workflow_id,
+                version=(latest_version or 0) + 1,
+                graph=dump_snapshot(workflow)
+            )
+            self.db.add(db_version)
+            try:
+                self.db.commit()
+            except IntegrityError:
+                self.db.rollback()
+                continue
+            self.db.refresh(db_version)
+            return db_version
+
+        raise HTTPException(status_code=409, detail="Workflow is being published concurrently, try again.")
+
+    def get_workflow_versions(self, workflow_id: int) -> List[models.WorkflowVersion]:
+        return self.read_db.query(models.WorkflowVersion).filter(
+            models.WorkflowVersion.workflow_id == workflow_id
+        ).order_by(models.WorkflowVersion.version).all()
+
+    def get_published_graph(self, workflow_id: int, version: int, trace=NULL_TRACE) -> Optional[nx.DiGraph]:
+        key = (workflow_id, version)
+        with _published_graphs_lock:
+            if key in _published_graphs:
+                _published_graphs.move_to_end(key)
+                trace.annotate(snapshot_cache="hit")
+                return _published_graphs[key]
+        trace.annotate(snapshot_cache="miss")
+
+        with trace.phase("load"):
+            blob = self.read_db.query(models.WorkflowVersion.graph).filter(
+                models.WorkflowVersion.workflow_id == workflow_id,
+                models.WorkflowVersion.version == version
+            ).scalar()
+        if blob is None:
+            return None
+
+        with trace.phase("build_graph"):
+            G = build_graph(*load_snapshot(blob))
+        with _published_graphs_lock:
+            _published_graphs[key] = G
+            if len(_published_graphs) > PUBLISHED_GRAPH_CACHE_SIZE:
+                _published_graphs.popitem(last=False)
+        return G
+
+    def load_run_graph(self, workflow_id: int, version: Optional[int] = None, trace=NULL_TRACE):
+        """
+            Load the graph to run: a published version if ``version`` is given, else the draft.
+
+            Returns the graph and, for drafts, the loaded workflow.
+        """
+        if version is not None:
+            G = self.get_published_graph(workflow_id, version, trace=trace)
+            if G is None:
+                raise HTTPException(status_code=404, detail="Workflow version not found")
+            return G, None
+
+        with trace.phase("load"):
+            workflow = self.get_workflow(workflow_id)
+            if workflow is None:
+                raise HTTPException(status_code=404, detail="Workflow not found")
+            rows = workflow_rows(workflow)
+
+        with trace.phase("build_graph"):
+            G = build_graph(*rows)
+        return G, workflow
+
+    def run_workflow(self, workflow_id: int, version: Optional[int] = None, trace=NULL_TRACE,
+                     mode: RunMode = RunMode.shortest, limit: int = 10, offset: int = 0,
+                     max_depth: Optional[int] = None) -> dict:
+        """
+            Run a workflow, sharing the result with identical runs already in flight.
+
+            Traced runs always execute on their own, since the trace belongs to one request.
+        """
+        params = (mode, limit, offset, max_depth)
+        if trace.enabled or not singleflight.RUN_COALESCING:
+            return self._run_workflow(workflow_id, version, trace, *params)
+
+        graph_version = ("version", version) if version is not None else ("draft", draft_revision(workflow_id))
+        result, _ = singleflight.runs.do(
+            (workflow_id, graph_version, params),
+            lambda: self._run_workflow(workflow_id, version, NULL_TRACE, *params),
+        )
+        return dict(result)
+
+    def _run_workflow(self, workflow_id: int, version: Optional[int], trace, mode: RunMode, limit: int,
+                      offset: int, max_depth: Optional[int]) -> dict:
+        if mode != RunMode.shortest:
+            check_path_page(limit, offset, max_depth)
+
+        with trace.activate(self.db, self.read_db):
+            G, workflow = self.load_run_graph(workflow_id, version, trace=trace)
+            if mode == RunMode.shortest:
+                result, outcomes = run_graph(G, trace=trace)
+            else:
+                result, outcomes = run_paths(G, mode, limit, offset, max_depth, trace=trace)
+
+            if workflow is not None:
+                self.save_outcomes(changed_outcomes(G, outcomes))
+            return result
+
+    def save_outcomes(self, outcomes: Dict[int, Tuple[str, str, str]]):
+        """
+            Persist condition outcomes (edge id -> (status, message, expression)) with a single UPDATE.
+
+            An outcome is only written while its Message and Condition Nodes still hold the
+            message and expression it was evaluated from, so a node edited during the run
+            is never given a stale outcome.
+        """
+        if not outcomes:
+            return
+        message_node = aliased(models.Node)
+        condition_node = aliased(models.Node)
+        inputs_unchanged = exists().where(
+            message_node.id == models.Edge.start_node_id,
+            condition_node.id == models.Edge.end_node_id,
+            condition_node.type == NodeType.condition,
+            or_(*(
+                and_(
+                    models.Edge.id == edge_id,
+                    message_node.message == message,
+                    condition_node.condition_expression == expression,
+                )
+                for edge_id, (_, message, expression) in outcomes.items()
+            )),
+        )
+        self.db.execute(
+            update(models.Edge)
+            .where(models.Edge.id.in_(outcomes), inputs_unchanged)
+            .values(status=case({edge_id: status for edge_id, (status, _, _) in outcomes.items()},
+                                value=models.Edge.id))
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+
+    def stream_workflow(self, workflow_id: int, version: Optional[int] = None, mode: RunMode = RunMode.shortest,
+                        limit: int = 10, offset: int = 0, max_depth: Optional[int] = None) -> Iterator[dict]:
+        """
+            Load the workflow now and return a generator of run events.
+
+            The generator only touches the in-memory graph, so it can be consumed
+            after the request's session has been closed.
+        """
+        if mode != RunMode.shortest:
+            check_path_page(limit, offset, max_depth)
+        G, _ = self.load_run_graph(workflow_id, version)
+        return iter_run_events(G, mode, limit, offset, max_depth)
+
     def create_node(self, workflow_id: int, node: NodeCreate) -> models.Node:
+        if batching.WRITE_BATCHING:
+            db_node = batching.get_batcher(self._write_bind(workflow_id)).insert(self.new_node(workflow_id, node))
+        else:
+            db_node = self.add_node(workflow_id, node)
+            self.db.commit()
+            self.db.refresh(db_node)
+        bump_draft_revision(workflow_id)
+        return db_node
+
+    @staticmethod
+    def new_node(workflow_id: int, node: NodeCreate) -> models.Node:
+        """
+            Validate a new node and build it without touching the database.
+        """
         if node.type == NodeType.message and not node.message:
             raise ValueError("Message Node must have a message.")
         if node.type == NodeType.condition and not node.condition_expression:
             raise ValueError("Condition Node must have a condition expression.")
 
-        db_node = models.Node(
+        return models.Node(
             type=node.type,
             status=node.status,
             message=node.message,
@@ -44,9 +419,14 @@ class WorkflowService:
             condition_expression=node.condition_expression,
             workflow_id=workflow_id
         )
+
+    def add_node(self, workflow_id: int, node: NodeCreate) -> models.Node:
+        """
+            Validate and flush a new node without committing.
+        """
+        db_node = self.new_node(workflow_id, node)
         self.db.add(db_node)
-        self.db.commit()
-        self.db.refresh(db_node)
+        self.db.flush()
         return db_node
 
     def get_all_nodes(
@@ -54,27 +434,55 @@ class WorkflowService:
             skip: int = 0,
             limit: int = 100,
     ) -> List[models.Node]:
-        return self.db.query(models.Node).offset(skip).limit(limit).all()
+        return self._list_by_id(self.read_db.query(models.Node), models.Node, skip, limit)
 
     def get_node(self, node_id: int):
-        return self.db.query(models.Node).filter(models.Node.id == node_id).first()
+        return self.read_db.query(models.Node).filter(models.Node.id == node_id).first()
 
     def update_node(self, node_id: int, node: NodeCreate) -> models.Node:
         db_node = self.db.query(models.Node).filter(models.Node.id == node_id).first()
+        condition_inputs = (db_node.type, db_node.message, db_node.condition_expression)
         for key, value in node.dict().items():
             setattr(db_node, key, value)
+        if (db_node.type, db_node.message, db_node.condition_expression) != condition_inputs:
+            self.invalidate_outcomes(db_node)
         self.db.commit()
         self.db.refresh(db_node)
+        bump_draft_revision(db_node.workflow_id)
         return db_node
 
-    def delete_node(self, node_id: int) -> models.Node:
-        db_node = self.db.query(models.Node).filter(models.Node.id == node_id).first()
-        self.db.delete(db_node)
+    def invalidate_outcomes(self, db_node: models.Node):
+        """
+            Clear the stored outcome of every Message -> Condition edge touching ``db_node``.
+        """
+        condition_nodes = select(models.Node.id).where(
+            models.Node.workflow_id == db_node.workflow_id, models.Node.type == NodeType.condition
+        )
+        self.db.flush()
+        self.db.execute(
+            update(models.Edge)
+            .where(
+                or_(models.Edge.start_node_id == db_node.id, models.Edge.end_node_id == db_node.id),
+                models.Edge.end_node_id.in_(condition_nodes),
+            )
+            .values(status=None)
+            .execution_options(synchronize_session=False)
+        )
+
+    def delete_node(self, node_id: int):
+        existing = self.db.query(models.Node.workflow_id).filter(models.Node.id == node_id).first()
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Node not found")
+
+        self.db.execute(delete(models.Edge).where(
+            or_(models.Edge.start_node_id == node_id, models.Edge.end_node_id == node_id)
+        ))
+        self.db.execute(delete(models.Node).where(models.Node.id == node_id))
         self.db.commit()
-        return db_node
+        bump_draft_revision(existing.workflow_id)
 
     def get_incoming_edges(self, node_id: int):
-        return self.db.query(models.Edge).filter(models.Edge.end_node_id == node_id).all()
+        return self.read_db.query(models.Edge).filter(models.Edge.end_node_id == node_id).all()
 
     def find_last_message_node(self, node):
         incoming_edges = self.get_incoming_edges(node.id)
@@ -93,6 +501,64 @@ class WorkflowService:
         return None
 
     def create_edge(self, workflow_id: int, edge: schemas.EdgeCreate) -> models.Edge:
+        for _ in range(EDGE_WRITE_ATTEMPTS):
+            # Evaluated before the write transaction opens, so a slow condition never holds the write lock.
+            evaluated = self.evaluate_edge_condition(edge.start_node_id, edge.end_node_id)
+            try:
+                if batching.WRITE_BATCHING:
+                    db_edge = batching.get_batcher(self._write_bind(workflow_id)).submit(
+                        lambda db: WorkflowService(db, db).add_edge(workflow_id, edge, evaluated)
+                    )
+                else:
+                    db_edge = self.add_edge(workflow_id, edge, evaluated)
+                    self.db.commit()
+                    self.db.refresh(db_edge)
+            except ConditionInputsChanged:
+                self.db.rollback()
+                self.read_db.rollback()
+                continue
+            bump_draft_revision(workflow_id)
+            return db_edge
+        raise HTTPException(status_code=409, detail="Nodes changed while the edge was being created, try again.")
+
+    def evaluate_edge_condition(self, start_node_id: int, end_node_id: int) -> Optional[Tuple[str, str, str]]:
+        """
+            Evaluate the condition of a Message -> Condition edge from the read pool.
+
+            Returns ``(outcome, message, expression)``, or None when the edge does not end
+            at a Condition Node. ``check_edge_condition`` confirms the inputs inside the
+            write transaction.
+        """
+        nodes = {
+            node.id: node for node in
+            self.read_db.query(models.Node).filter(models.Node.id.in_((start_node_id, end_node_id)))
+        }
+        start_node, end_node = nodes.get(start_node_id), nodes.get(end_node_id)
+        if end_node is None or end_node.type != NodeType.condition:
+            return None
+        if start_node is None or start_node.type != NodeType.message:
+            return None
+        return self.condition_outcome(start_node, end_node), start_node.message, end_node.condition_expression
+
+    @staticmethod
+    def check_edge_condition(start_node: Optional[models.Node], end_node: models.Node,
+                             evaluated: Optional[Tuple[str, str, str]]) -> str:
+        """
+            Return the outcome evaluated for ``end_node`` if its inputs are still current.
+        """
+        if start_node is None or start_node.type != NodeType.message:
+            raise HTTPException(status_code=400, detail="Condition Node must be preceded by a Message Node.")
+        if evaluated is None or evaluated[1:] != (start_node.message, end_node.condition_expression):
+            raise ConditionInputsChanged()
+        return evaluated[0]
+
+    def add_edge(self, workflow_id: int, edge: schemas.EdgeCreate,
+                 evaluated: Optional[Tuple[str, str, str]] = None) -> models.Edge:
+        """
+            Validate and flush a new edge without committing.
+
+            ``evaluated`` is the condition outcome from ``evaluate_edge_condition``.
+        """
         start_node = self.db.query(models.Node).get(edge.start_node_id)
         end_node = self.db.query(models.Node).get(edge.end_node_id)
 
@@ -136,18 +602,7 @@ class WorkflowService:
             raise HTTPException(status_code=400, detail="Start Node cannot be an end node.")
 
         if end_node.type == NodeType.condition:
-
-            if not start_node.type == NodeType.message:
-                raise HTTPException(status_code=400, detail="Condition Node must be preceded by a Message Node.")
-
-            condition = end_node.condition_expression
-            context = {'message': start_node.message}
-            rule = rule_engine.Rule(condition)
-
-            if rule.evaluate(context):
-                edge.status = "Yes"
-            else:
-                edge.status = "No"
+            edge.status = self.check_edge_condition(start_node, end_node, evaluated)
 
         db_edge = models.Edge(
             workflow_id=workflow_id,
@@ -156,38 +611,74 @@ class WorkflowService:
             status=edge.status
         )
         self.db.add(db_edge)
-        self.db.commit()
-        self.db.refresh(db_edge)
+        self.db.flush()
         return db_edge
 
+    @staticmethod
+    def condition_outcome(start_node: Optional[models.Node], end_node: models.Node) -> str:
+        """
+            Evaluate the Condition Node ``end_node`` against the message of ``start_node``.
+        """
+        if start_node is None or start_node.type != NodeType.message:
+            raise HTTPException(status_code=400, detail="Condition Node must be preceded by a Message Node.")
+
+        try:
+            result, _ = conditions.evaluator.evaluate(end_node.condition_expression, start_node.message)
+        except conditions.ConditionError as exc:
+            raise HTTPException(status_code=400, detail=exc.detail)
+        return "Yes" if result else "No"
+
     def get_edge_by_id(self, edge_id: int) -> models.Edge:
-        db_edge = self.db.query(models.Edge).filter(models.Edge.id == edge_id).first()
+        db_edge = self.read_db.query(models.Edge).filter(models.Edge.id == edge_id).first()
         if not db_edge:
             raise HTTPException(status_code=404, detail="Edge not found")
         return db_edge
 
     def update_edge(self, edge_id: int, edge: EdgeCreate) -> models.Edge:
-        db_edge = self.db.query(models.Edge).filter(models.Edge.id == edge_id).first()
-        if not db_edge:
-            raise HTTPException(status_code=404, detail="Edge not found")
-
-        for key, value in edge.dict().items():
-            setattr(db_edge, key, value)
-        self.db.commit()
-        self.db.refresh(db_edge)
-        return db_edge
+        for _ in range(EDGE_WRITE_ATTEMPTS):
+            evaluated = self.evaluate_edge_condition(edge.start_node_id, edge.end_node_id)
+
+            db_edge = self.db.query(models.Edge).filter(models.Edge.id == edge_id).first()
+            if not db_edge:
+                raise HTTPException(status_code=404, detail="Edge not found")
+
+            for key, value in edge.dict().items():
+                setattr(db_edge, key, value)
+
+            # A Message -> Condition edge stores the condition's outcome, so recompute it
+            # rather than trusting the client-supplied status.
+            nodes = {
+                node.id: node for node in
+                self.db.query(models.Node).filter(models.Node.id.in_((db_edge.start_node_id, db_edge.end_node_id)))
+            }
+            end_node = nodes.get(db_edge.end_node_id)
+            if end_node is not None and end_node.type == NodeType.condition:
+                try:
+                    db_edge.status = self.check_edge_condition(nodes.get(db_edge.start_node_id), end_node, evaluated)
+                except ConditionInputsChanged:
+                    self.db.rollback()
+                    self.read_db.rollback()
+                    continue
+
+            self.db.commit()
+            self.db.refresh(db_edge)
+            bump_draft_revision(db_edge.workflow_id)
+            return db_edge
+        raise HTTPException(status_code=409, detail="Nodes changed while the edge was being updated, try again.")
 
     def delete_edge(self, edge_id: int):
         db_edge = self.db.query(models.Edge).filter(models.Edge.id == edge_id).first()
         if not db_edge:
             raise HTTPException(status_code=404, detail="Edge not found")
+        workflow_id = db_edge.workflow_id
         self.db.delete(db_edge)
         self.db.commit()
+        bump_draft_revision(workflow_id)
 
     def get_all_edges(
             self,
             skip: int = 0,
             limit: int = 100,
     ) -> List[models.Edge]:
-        return self.db.query(models.Edge).offset(skip).limit(limit).all()
+        return self._list_by_id(self.read_db.query(models.Edge), models.Edge, skip, limit)
 
@@ -0,0 +1,58 @@
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+RUN_COALESCING = os.getenv("RUN_COALESCING", "1") == "1"
+
+
+class SingleFlight:
+    """
+        Lets concurrent callers with the same key share one in-flight call.
+
+        The first caller runs the function; callers arriving while it runs wait
+        for and receive its result or exception. A key is released before its
+        result is published, so callers arriving later start a fresh call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._counters = {"executions": 0, "coalesced": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+            Return ``fn()``'s result and whether it was shared from another caller's call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._counters["executions"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._release(key)
+            future.set_exception(exc)
+            raise
+        self._release(key)
+        future.set_result(result)
+        return result, False
+
+    def _release(self, key: Hashable):
+        with self._lock:
+            del self._calls[key]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._counters, "in_flight": len(self._calls)}
+
+
+runs = SingleFlight()
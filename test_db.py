@@ -1,5 +1,9 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from db import shards
+from db.engine import read_only_url
 from db.models import Base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_workflow.db"
@@ -7,8 +11,14 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./test_workflow.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+shards.use_immediate_transactions(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+read_engine = create_engine(
+    read_only_url(SQLALCHEMY_DATABASE_URL), connect_args={"check_same_thread": False}
+)
+TestingReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
 def override_get_db():
     try:
         db = TestingSessionLocal()
@@ -16,4 +26,42 @@ def override_get_db():
     finally:
         db.close()
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+def override_get_read_db():
+    try:
+        db = TestingReadSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+Base.metadata.create_all(bind=engine)
+
+
+@contextmanager
+def count_queries(binds=(engine, read_engine)):
+    """
+        Collect every SQL statement sent to ``binds`` while the block runs.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for bind in binds:
+        event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for bind in binds:
+            event.remove(bind, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(limit, binds=(engine, read_engine)):
+    """
+        Fail when the block sends more than ``limit`` SQL statements to ``binds``.
+    """
+    with count_queries(binds) as statements:
+        yield statements
+    assert len(statements) <= limit, (
+        f"Expected at most {limit} queries, got {len(statements)}:\n" + "\n".join(statements)
+    )
@@ -0,0 +1,23 @@
+from loadtest import compare_to_baseline, percentile
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 95) == 95
+    assert percentile(samples, 99) == 99
+    assert percentile([], 99) == 0.0
+
+
+def test_compare_to_baseline():
+    baseline = {"GET /nodes/": {"p50": 10.0, "p95": 20.0, "p99": 30.0, "throughput": 100.0, "error_rate": 0.0}}
+    steady = {"GET /nodes/": {"p50": 11.0, "p95": 21.0, "p99": 31.0, "throughput": 95.0, "error_rate": 0.0}}
+    slower = {"GET /nodes/": {"p50": 11.0, "p95": 40.0, "p99": 31.0, "throughput": 50.0, "error_rate": 0.05}}
+
+    assert compare_to_baseline(steady, baseline, tolerance=0.2) == []
+
+    regressions = compare_to_baseline(slower, baseline, tolerance=0.2)
+    assert len(regressions) == 3
+    assert any("p95" in regression for regression in regressions)
+    assert any("throughput" in regression for regression in regressions)
+    assert any("error rate" in regression for regression in regressions)
@@ -1,11 +1,33 @@
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from fastapi.testclient import TestClient
-
-from db.models import Base
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import batching
+import conditions
+import schemas
+import services
+import singleflight
+import tracing
+from db import outcomes
+from db.models import Base, WorkflowVersion
+from dependencies import get_read_db
 from main import app, get_db
-from test_db import override_get_db, TestingSessionLocal
+from services import WorkflowService, clear_published_graph_cache
+from test_db import (
+    SQLALCHEMY_DATABASE_URL, assert_max_queries, count_queries, engine, override_get_db, override_get_read_db, read_engine,
+    TestingReadSessionLocal, TestingSessionLocal
+)
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_read_db
 
 client = TestClient(app)
 
@@ -15,6 +37,7 @@ def setup_and_teardown():
     Base.metadata.create_all(bind=TestingSessionLocal().get_bind())
     yield
 
+    clear_published_graph_cache()
     Base.metadata.drop_all(bind=TestingSessionLocal().get_bind())
 
 
@@ -258,3 +281,798 @@ def test_run_workflow_with_complex_scenario():
     response_json = response.json()
     assert response.status_code == 200
     assert "path" in response_json
+
+
+def test_clone_workflow():
+    workflow = create_workflow(client)
+    workflow_id = workflow["id"]
+
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="Hello")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    create_edge(client, workflow_id, message_node["id"], end_node["id"], None)
+
+    response = client.post(f"/workflows/{workflow_id}/clone")
+    assert response.status_code == 200
+
+    cloned = response.json()
+    assert cloned["id"] != workflow_id
+    assert cloned["name"] == workflow["name"]
+    assert len(cloned["nodes"]) == 3
+    assert len(cloned["edges"]) == 2
+
+    original_node_ids = {start_node["id"], message_node["id"], end_node["id"]}
+    cloned_node_ids = {n["id"] for n in cloned["nodes"]}
+    assert not original_node_ids & cloned_node_ids
+    assert all(n["workflow_id"] == cloned["id"] for n in cloned["nodes"])
+    for edge in cloned["edges"]:
+        assert edge["start_node_id"] in cloned_node_ids
+        assert edge["end_node_id"] in cloned_node_ids
+
+    missing_response = client.post(f"/workflows/{workflow_id + 999}/clone")
+    assert missing_response.status_code == 404
+    assert missing_response.json()["detail"] == "Workflow not found"
+
+
+def test_clone_workflow_requires_sqlite(monkeypatch):
+    workflow_id = create_workflow(client)["id"]
+    monkeypatch.setattr(engine.dialect, "name", "postgresql")
+
+    response = client.post(f"/workflows/{workflow_id}/clone")
+
+    assert response.status_code == 501
+    assert response.json()["detail"] == "Cloning is only supported on SQLite databases."
+
+
+def test_publish_and_run_workflow_version():
+    workflow = create_workflow(client)
+    workflow_id = workflow["id"]
+
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="Hello")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    create_edge(client, workflow_id, message_node["id"], end_node["id"], None)
+
+    response = client.post(f"/workflows/{workflow_id}/publish")
+    assert response.status_code == 200
+    published = response.json()
+    assert published["workflow_id"] == workflow_id
+    assert published["version"] == 1
+
+    updated_node = {"type": "Message", "status": "pending", "message": "Edited draft"}
+    assert client.put(f"/nodes/{message_node['id']}/", json=updated_node).status_code == 200
+
+    version_response = client.post(f"/workflows/{workflow_id}/run/", params={"version": 1})
+    assert version_response.status_code == 200
+    assert version_response.json()["path"][1]["message"] == "Hello"
+
+    draft_response = client.post(f"/workflows/{workflow_id}/run/")
+    assert draft_response.status_code == 200
+    assert draft_response.json()["path"][1]["message"] == "Edited draft"
+
+    second = client.post(f"/workflows/{workflow_id}/publish").json()
+    assert second["version"] == 2
+    versions = client.get(f"/workflows/{workflow_id}/versions/").json()
+    assert [v["version"] for v in versions] == [1, 2]
+
+    missing_response = client.post(f"/workflows/{workflow_id}/run/", params={"version": 99})
+    assert missing_response.status_code == 404
+
+
+# Maximum number of SQL statements each endpoint may issue. The budgets do not
+# depend on workflow size, so any per-node or per-workflow query fails the test.
+QUERY_BUDGETS = {
+    "GET /workflows/": 3,
+    "GET /workflows/{id}/": 3,
+    "POST /workflows/": 4,
+    "POST /workflows/{id}/clone": 9,
+    "POST /workflows/{id}/publish": 6,
+    "GET /workflows/{id}/versions/": 1,
+    "POST /workflows/{id}/run/": 3,
+    "POST /workflows/{id}/run/?version": 1,
+    "POST /workflows/{id}/run/?mode=k_shortest": 3,
+    "POST /workflows/{id}/run/?mode=all_paths": 3,
+    "POST /workflows/{id}/run/stream": 3,
+    "POST /workflows/{id}/run/stream?version": 1,
+    "POST /workflows/{id}/run/stream?mode=all_paths": 3,
+    "POST /workflows/{id}/nodes/": 2,
+    "GET /nodes/": 1,
+    "GET /nodes/{id}/": 1,
+    "PUT /nodes/{id}/": 4,
+    "POST /workflows/{id}/edges/": 6,
+    "GET /edges/": 1,
+    "GET /edges/{id}/": 1,
+    "PUT /edges/{id}/": 4,
+    "DELETE /edges/{id}/": 2,
+    "DELETE /nodes/{id}/": 3,
+    "DELETE /workflows/{id}/": 5,
+}
+
+
+def create_chain_workflow(client, size):
+    workflow_id = create_workflow(client)["id"]
+    nodes = [create_node(client, workflow_id)]
+    nodes += [create_node(client, workflow_id, node_type="Message", message=f"Message {i}") for i in range(size)]
+    nodes += [create_node(client, workflow_id, node_type="End")]
+    edges = [
+        create_edge(client, workflow_id, start["id"], end["id"], None)
+        for start, end in zip(nodes, nodes[1:])
+    ]
+    nodes.append(create_node(client, workflow_id, node_type="Message", message="Unlinked"))
+    for _ in range(size):
+        create_workflow(client)
+    client.post(f"/workflows/{workflow_id}/publish")
+    return workflow_id, nodes, edges
+
+
+def call_endpoint(endpoint, workflow_id, nodes, edges):
+    message_node = nodes[1]
+    edge = edges[-1]
+    calls = {
+        "GET /workflows/": lambda: client.get("/workflows/"),
+        "GET /workflows/{id}/": lambda: client.get(f"/workflows/{workflow_id}/"),
+        "POST /workflows/": lambda: client.post("/workflows/", json={"name": "Budget"}),
+        "POST /workflows/{id}/clone": lambda: client.post(f"/workflows/{workflow_id}/clone"),
+        "POST /workflows/{id}/publish": lambda: client.post(f"/workflows/{workflow_id}/publish"),
+        "GET /workflows/{id}/versions/": lambda: client.get(f"/workflows/{workflow_id}/versions/"),
+        "POST /workflows/{id}/run/": lambda: client.post(f"/workflows/{workflow_id}/run/"),
+        "POST /workflows/{id}/run/?version": lambda: client.post(
+            f"/workflows/{workflow_id}/run/", params={"version": 1}
+        ),
+        "POST /workflows/{id}/run/?mode=k_shortest": lambda: client.post(
+            f"/workflows/{workflow_id}/run/", params={"mode": "k_shortest"}
+        ),
+        "POST /workflows/{id}/run/?mode=all_paths": lambda: client.post(
+            f"/workflows/{workflow_id}/run/", params={"mode": "all_paths"}
+        ),
+        "POST /workflows/{id}/run/stream": lambda: client.post(f"/workflows/{workflow_id}/run/stream"),
+        "POST /workflows/{id}/run/stream?version": lambda: client.post(
+            f"/workflows/{workflow_id}/run/stream", params={"version": 1}
+        ),
+        "POST /workflows/{id}/run/stream?mode=all_paths": lambda: client.post(
+            f"/workflows/{workflow_id}/run/stream", params={"mode": "all_paths"}
+        ),
+        "POST /workflows/{id}/nodes/": lambda: client.post(
+            f"/workflows/{workflow_id}/nodes/", json={"type": "Message", "message": "New"}
+        ),
+        "GET /nodes/": lambda: client.get("/nodes/"),
+        "GET /nodes/{id}/": lambda: client.get(f"/nodes/{message_node['id']}/"),
+        "PUT /nodes/{id}/": lambda: client.put(
+            f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "Updated"}
+        ),
+        "POST /workflows/{id}/edges/": lambda: client.post(
+            f"/workflows/{workflow_id}/edges/",
+            json={"start_node_id": nodes[-1]["id"], "end_node_id": nodes[-2]["id"]}
+        ),
+        "GET /edges/": lambda: client.get("/edges/"),
+        "GET /edges/{id}/": lambda: client.get(f"/edges/{edge['id']}/"),
+        "PUT /edges/{id}/": lambda: client.put(
+            f"/edges/{edge['id']}/",
+            json={"start_node_id": edge["start_node_id"], "end_node_id": edge["end_node_id"]}
+        ),
+        "DELETE /edges/{id}/": lambda: client.delete(f"/edges/{edge['id']}/"),
+        "DELETE /nodes/{id}/": lambda: client.delete(f"/nodes/{message_node['id']}/"),
+        "DELETE /workflows/{id}/": lambda: client.delete(f"/workflows/{workflow_id}/"),
+    }
+    return calls[endpoint]()
+
+
+@pytest.fixture
+def query_budget():
+    """
+        Context manager factory asserting an endpoint stays within its query budget.
+    """
+    def budget(endpoint):
+        return assert_max_queries(QUERY_BUDGETS[endpoint])
+    return budget
+
+
+@pytest.mark.parametrize("size", [1, 20])
+@pytest.mark.parametrize("endpoint", list(QUERY_BUDGETS))
+def test_endpoint_query_budget(endpoint, size, query_budget):
+    workflow_id, nodes, edges = create_chain_workflow(client, size)
+
+    with query_budget(endpoint):
+        response = call_endpoint(endpoint, workflow_id, nodes, edges)
+
+    assert response.status_code < 400, response.text
+
+
+def test_concurrent_publishes_get_distinct_versions():
+    workflow_id = create_workflow(client)["id"]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: client.post(f"/workflows/{workflow_id}/publish"), range(8)))
+
+    assert [response.status_code for response in responses] == [200] * 8
+    assert sorted(response.json()["version"] for response in responses) == list(range(1, 9))
+
+
+def test_publish_retries_after_a_conflicting_version(monkeypatch):
+    workflow_id = create_workflow(client)["id"]
+    # pysqlite's default transactions take no lock for reads, so another writer can win the race.
+    racing_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    original_dump_snapshot = services.dump_snapshot
+    raced = []
+
+    def racing_dump_snapshot(workflow):
+        if not raced:
+            raced.append(True)
+            with racing_engine.begin() as conn:
+                conn.execute(insert(WorkflowVersion).values(workflow_id=workflow_id, version=1, graph=b""))
+        return original_dump_snapshot(workflow)
+
+    monkeypatch.setattr(services, "dump_snapshot", racing_dump_snapshot)
+    try:
+        with sessionmaker(bind=racing_engine)() as db:
+            assert WorkflowService(db, db).publish_workflow(workflow_id).version == 2
+    finally:
+        racing_engine.dispose()
+
+
+def test_run_workflow_trace(monkeypatch):
+    workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    create_edge(client, workflow_id, condition_node["id"], end_node["id"], "Yes")
+
+    untraced = client.post(f"/workflows/{workflow_id}/run/").json()
+    assert "trace" not in untraced
+    engine_listeners = [len(bind.dispatch.before_cursor_execute) for bind in (engine, read_engine)]
+
+    response = client.post(f"/workflows/{workflow_id}/run/", params={"trace": True})
+    assert response.status_code == 200
+    trace = response.json()["trace"]
+
+    phases = {phase["name"]: phase for phase in trace["phases"]}
+    assert set(phases) == {"load", "build_graph", "shortest_path", "find_last_message_node"}
+    assert phases["load"]["sql"] == trace["sql"] == 3
+    assert phases["shortest_path"]["sql"] == 0
+
+    assert len(trace["conditions"]) == 1
+    condition = trace["conditions"][0]
+    assert condition["node_id"] == condition_node["id"]
+    assert condition["message_node_id"] == message_node["id"]
+    assert condition["outcome"] == "Yes"
+    assert condition["rule_cache"] == "stored"
+    # Tracing hooks only the traced run's connections, so untraced SQL pays nothing.
+    assert [len(bind.dispatch.before_cursor_execute) for bind in (engine, read_engine)] == engine_listeners
+
+    # Evaluate inline, so the compiled-rule cache is this process's and the reported value is exact.
+    monkeypatch.setattr(conditions.evaluator, "pool_size", 0)
+    client.put(f"/nodes/{condition_node['id']}/", json={
+        "type": "Condition", "message": "Condition", "condition_expression": "message == 'trace miss'"
+    })
+    trace = client.post(f"/workflows/{workflow_id}/run/", params={"trace": True}).json()["trace"]
+    assert "rule_evaluation" in {phase["name"] for phase in trace["phases"]}
+    assert trace["conditions"][0]["outcome"] == "No"
+    assert trace["conditions"][0]["rule_cache"] == "miss"
+
+    client.put(f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "bye"})
+    trace = client.post(f"/workflows/{workflow_id}/run/", params={"trace": True}).json()["trace"]
+    assert trace["conditions"][0]["outcome"] == "No"
+    assert trace["conditions"][0]["rule_cache"] == "hit"
+
+
+def test_sampled_trace_is_logged(monkeypatch):
+    workflow_id, _, _ = create_chain_workflow(client, 1)
+    stream = io.StringIO()
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(tracing.log_handler, "stream", stream)
+
+    response = client.post(f"/workflows/{workflow_id}/run/")
+
+    assert response.status_code == 200
+    assert "trace" not in response.json()
+    logged = json.loads(stream.getvalue())
+    assert logged["event"] == "workflow_run_trace"
+    assert logged["workflow_id"] == workflow_id
+
+
+def test_condition_outcomes_are_stored_and_invalidated():
+    workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    condition_edge = create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    create_edge(client, workflow_id, condition_node["id"], end_node["id"], "Yes")
+    assert condition_edge["status"] == "Yes"
+
+    evaluations = conditions.evaluator.metrics()["evaluations"]
+    with count_queries() as statements:
+        client.post(f"/workflows/{workflow_id}/run/")
+    assert conditions.evaluator.metrics()["evaluations"] == evaluations
+    assert not [statement for statement in statements if statement.startswith("UPDATE")]
+
+    client.put(f"/nodes/{condition_node['id']}/", json={
+        "type": "Condition", "message": "Condition", "condition_expression": "message == 'bye'"
+    })
+    assert client.get(f"/edges/{condition_edge['id']}/").json()["status"] is None
+    outgoing = client.get("/edges/").json()
+    assert [edge["status"] for edge in outgoing if edge["start_node_id"] == condition_node["id"]] == ["Yes"]
+
+    with count_queries() as statements:
+        client.post(f"/workflows/{workflow_id}/run/")
+    assert len([statement for statement in statements if statement.startswith("UPDATE")]) == 1
+    assert client.get(f"/edges/{condition_edge['id']}/").json()["status"] == "No"
+
+    client.put(f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "hi"})
+    client.put(f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "hello"})
+    assert client.get(f"/edges/{condition_edge['id']}/").json()["status"] is None
+    hits = conditions.evaluator.metrics()["outcome_cache_hits"]
+    client.post(f"/workflows/{workflow_id}/run/")
+    assert conditions.evaluator.metrics()["outcome_cache_hits"] == hits + 1
+    assert client.get(f"/edges/{condition_edge['id']}/").json()["status"] == "No"
+
+
+def test_update_edge_recomputes_condition_outcome():
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    hello, bye = (
+        create_node(client, workflow_id, node_type="Condition", message="Condition",
+                    condition_expression=f"message == '{text}'")
+        for text in ("hello", "bye")
+    )
+    edge = create_edge(client, workflow_id, message_node["id"], hello["id"], None)
+    assert edge["status"] == "Yes"
+
+    response = client.put(f"/edges/{edge['id']}/", json={
+        "start_node_id": message_node["id"], "end_node_id": bye["id"], "status": "Yes"
+    })
+    assert response.status_code == 200
+    assert response.json()["status"] == "No"
+
+    start_node = create_node(client, workflow_id)
+    response = client.put(f"/edges/{edge['id']}/", json={
+        "start_node_id": start_node["id"], "end_node_id": bye["id"], "status": "Yes"
+    })
+    assert response.status_code == 400
+
+
+def test_condition_is_evaluated_outside_the_write_transaction(monkeypatch):
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    original_condition_outcome = WorkflowService.condition_outcome
+    write_seconds = []
+
+    def slow_condition_outcome(start_node, end_node):
+        # Another writer must not wait for this evaluation.
+        started = time.perf_counter()
+        with TestingSessionLocal() as db:
+            WorkflowService(db, db).create_node(workflow_id, schemas.NodeCreate(type="Start"))
+        write_seconds.append(time.perf_counter() - started)
+        return original_condition_outcome(start_node, end_node)
+
+    monkeypatch.setattr(WorkflowService, "condition_outcome", staticmethod(slow_condition_outcome))
+    edge = create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+
+    assert edge["status"] == "Yes"
+    assert len(write_seconds) == 1 and write_seconds[0] < 0.5
+
+
+def test_condition_inputs_changed_during_evaluation_are_reevaluated(monkeypatch):
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    original_condition_outcome = WorkflowService.condition_outcome
+    messages = []
+
+    def racing_condition_outcome(start_node, end_node):
+        messages.append(start_node.message)
+        if len(messages) == 1:
+            client.put(f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "bye"})
+        return original_condition_outcome(start_node, end_node)
+
+    monkeypatch.setattr(WorkflowService, "condition_outcome", staticmethod(racing_condition_outcome))
+    edge = create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+
+    assert messages == ["hello", "bye"]
+    assert edge["status"] == "No"
+
+
+def test_stale_condition_outcome_is_not_saved():
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    edge = create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    client.put(f"/nodes/{condition_node['id']}/", json={
+        "type": "Condition", "message": "Condition", "condition_expression": "message == 'hi'"
+    })
+
+    with TestingSessionLocal() as db:
+        service = WorkflowService(db, db)
+        # Evaluated before the message changed; the write must not land.
+        stale = {edge["id"]: ("No", "hello", "message == 'hi'")}
+        client.put(f"/nodes/{message_node['id']}/", json={"type": "Message", "message": "hi"})
+        service.save_outcomes(stale)
+        assert client.get(f"/edges/{edge['id']}/").json()["status"] is None
+
+        service.save_outcomes({edge["id"]: ("Yes", "hi", "message == 'hi'")})
+        assert client.get(f"/edges/{edge['id']}/").json()["status"] == "Yes"
+
+
+def test_clear_stored_outcomes():
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    end_node = create_node(client, workflow_id, node_type="End")
+    condition_edge = create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    branch_edge = create_edge(client, workflow_id, condition_node["id"], end_node["id"], "Yes")
+    assert condition_edge["status"] == "Yes"
+
+    assert outcomes.clear_stored_outcomes(SQLALCHEMY_DATABASE_URL) == 1
+
+    assert client.get(f"/edges/{condition_edge['id']}/").json()["status"] is None
+    assert client.get(f"/edges/{branch_edge['id']}/").json()["status"] == "Yes"
+
+
+def test_stream_workflow():
+    workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'bye'")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    create_edge(client, workflow_id, condition_node["id"], end_node["id"], "No")
+
+    response = client.post(f"/workflows/{workflow_id}/run/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["step", "step", "step", "step", "end"]
+    assert [event["id"] for event in events[:-1]] == [
+        start_node["id"], message_node["id"], condition_node["id"], end_node["id"]
+    ]
+    assert events[2]["condition"] == "No"
+    assert events[-1]["steps"] == 4
+
+    sse_response = client.post(f"/workflows/{workflow_id}/run/stream", headers={"Accept": "text/event-stream"})
+    assert sse_response.headers["content-type"].startswith("text/event-stream")
+    assert sse_response.text.startswith("event: step\ndata: ")
+    assert sse_response.text.rstrip().splitlines()[-2] == "event: end"
+
+    empty_workflow_id = create_workflow(client)["id"]
+    error_response = client.post(f"/workflows/{empty_workflow_id}/run/stream")
+    assert json.loads(error_response.text) == {"event": "error", "error": "No start node found"}
+
+
+def create_branching_workflow(client):
+    workflow_id = create_workflow(client)["id"]
+    start = create_node(client, workflow_id)
+    other_start = create_node(client, workflow_id)
+    a, b, d = (create_node(client, workflow_id, node_type="Message", message=name) for name in "abd")
+    first, second = (
+        create_node(client, workflow_id, node_type="Condition", message="Condition",
+                     condition_expression=f"message == '{name}'")
+        for name in "ab"
+    )
+    end = create_node(client, workflow_id, node_type="End")
+    for start_node, end_node, status in [
+        (start, a, None), (a, first, None), (first, end, "Yes"), (first, b, "No"), (other_start, b, None),
+        (b, second, None), (second, end, "Yes"), (second, d, "No"), (d, end, None),
+    ]:
+        create_edge(client, workflow_id, start_node["id"], end_node["id"], status)
+    return workflow_id, [
+        [start, a, first, end],
+        [other_start, b, second, end],
+        [other_start, b, second, d, end],
+        [start, a, first, b, second, end],
+        [start, a, first, b, second, d, end],
+    ]
+
+
+def path_ids(paths):
+    return [[step["id"] for step in path] for path in paths]
+
+
+def test_run_workflow_path_modes():
+    workflow_id, expected = create_branching_workflow(client)
+    expected = path_ids(expected)
+    run_url = f"/workflows/{workflow_id}/run/"
+
+    k_shortest = client.post(run_url, params={"mode": "k_shortest"}).json()
+    assert sorted(path_ids(k_shortest["paths"])) == sorted(expected)
+    assert [len(path) for path in k_shortest["paths"]] == [4, 4, 5, 6, 7]
+    assert k_shortest["has_more"] is False
+
+    all_paths = client.post(run_url, params={"mode": "all_paths"}).json()
+    assert sorted(path_ids(all_paths["paths"])) == sorted(expected)
+
+    shallow = client.post(run_url, params={"mode": "all_paths", "max_depth": 5}).json()
+    assert sorted(path_ids(shallow["paths"])) == sorted(expected[:3])
+
+    first = client.post(run_url, params={"mode": "k_shortest", "limit": 2}).json()
+    rest = client.post(run_url, params={"mode": "k_shortest", "limit": 3, "offset": 2}).json()
+    assert first["has_more"] is True and rest["has_more"] is False
+    assert first["paths"] + rest["paths"] == k_shortest["paths"]
+
+    assert client.post(run_url, params={"mode": "all_paths", "offset": 10}).json()["paths"] == []
+    assert client.post(run_url, params={"mode": "all_paths", "limit": 0}).status_code == 400
+    assert client.post(run_url, params={"mode": "sideways"}).status_code == 422
+    assert client.post(run_url, params={"mode": "all_paths", "max_depth": 3}).json() == {
+        "error": "No path found from start to end node"
+    }
+
+
+def test_stream_workflow_path_modes():
+    workflow_id, expected = create_branching_workflow(client)
+
+    response = client.post(f"/workflows/{workflow_id}/run/stream", params={"mode": "k_shortest", "offset": 4})
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["path"] + ["step"] * 7 + ["end"]
+    assert events[0] == {"event": "path", "index": 4, "length": 7}
+    assert [event["id"] for event in events[1:-1]] == path_ids([expected[4]])[0]
+    assert all(event["path"] == 4 for event in events[1:-1])
+    assert [event["condition"] for event in events[1:-1]] == [None, None, "Yes", None, "Yes", None, None]
+    assert events[-1] == {"event": "end", "paths": 1, "steps": 7}
+
+
+def test_condition_evaluation_deadline(monkeypatch):
+    monkeypatch.setattr(conditions.evaluator, "timeout", 0.5)
+    workflow_id = create_workflow(client)["id"]
+    message_node = create_node(client, workflow_id, node_type="Message", message="a" * 40 + "b")
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message =~ '(a+)+$'")
+    timeouts = conditions.evaluator.metrics()["timeouts"]
+
+    edge_data = {"start_node_id": message_node["id"], "end_node_id": condition_node["id"]}
+    response = client.post(f"/workflows/{workflow_id}/edges/", json=edge_data)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Condition evaluation timed out."
+
+    metrics = client.get("/metrics/").json()["conditions"]
+    assert metrics["timeouts"] == timeouts + 1
+
+    assert conditions.evaluator.evaluate("message == 'hello'", "hello")[0] is True
+
+
+def test_condition_timeout_keeps_serving_while_pool_respawns():
+    evaluator = conditions.ConditionEvaluator(pool_size=2, timeout=0.5)
+    try:
+        assert evaluator.evaluate("message == 'warm'", "warm")[0] is True
+        with pytest.raises(conditions.ConditionTimeout):
+            evaluator.evaluate("message =~ '(a+)+$'", "a" * 40 + "b")
+
+        started = time.perf_counter()
+        assert evaluator.evaluate("message == 'warm'", "warm")[0] is True
+        assert evaluator.evaluate("message == 'other'", "other")[0] is True
+        assert evaluator.metrics()["timeouts"] == 1
+        assert time.perf_counter() - started < 0.3
+    finally:
+        evaluator.shutdown()
+
+
+def test_invalid_condition_expressions_are_client_errors():
+    workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="hello")
+    invalid = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                          condition_expression="message ==")
+    response = client.post(f"/workflows/{workflow_id}/edges/",
+                           json={"start_node_id": message_node["id"], "end_node_id": invalid["id"]})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid condition expression")
+
+    condition_node = create_node(client, workflow_id, node_type="Condition", message="Condition",
+                                 condition_expression="message == 'hello'")
+    end_node = create_node(client, workflow_id, node_type="End")
+    create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    create_edge(client, workflow_id, message_node["id"], condition_node["id"], None)
+    create_edge(client, workflow_id, condition_node["id"], end_node["id"], "Yes")
+    client.put(f"/nodes/{condition_node['id']}/", json={
+        "type": "Condition", "message": "Condition", "condition_expression": "message.no_such_attribute"
+    })
+
+    run = client.post(f"/workflows/{workflow_id}/run/")
+    assert run.status_code == 400
+    assert run.json()["detail"].startswith("Invalid condition expression")
+
+    events = [json.loads(line) for line in client.post(f"/workflows/{workflow_id}/run/stream").text.splitlines()]
+    assert events[-1]["event"] == "error"
+    assert events[-1]["error"].startswith("Invalid condition expression")
+
+
+def test_condition_evaluation_cost_limit(monkeypatch):
+    monkeypatch.setattr(conditions.evaluator, "max_cost", 100)
+    with pytest.raises(conditions.ConditionTooExpensive):
+        conditions.evaluator.evaluate("message == 'hello'", "x" * 100)
+
+
+def test_delete_node_removes_its_edges():
+    workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    message_node = create_node(client, workflow_id, node_type="Message", message="Hello")
+    end_node = create_node(client, workflow_id, node_type="End")
+    first_edge = create_edge(client, workflow_id, start_node["id"], message_node["id"], None)
+    second_edge = create_edge(client, workflow_id, message_node["id"], end_node["id"], None)
+
+    response = client.delete(f"/nodes/{message_node['id']}/")
+    assert response.status_code == 200
+
+    assert client.get(f"/nodes/{message_node['id']}/").status_code == 404
+    assert client.get(f"/nodes/{start_node['id']}/").status_code == 200
+    assert client.get(f"/edges/{first_edge['id']}/").status_code == 404
+    assert client.get(f"/edges/{second_edge['id']}/").status_code == 404
+
+    assert client.delete(f"/nodes/{message_node['id']}/").status_code == 404
+
+
+def test_delete_workflow():
+    workflow_id = create_workflow(client)["id"]
+    other_workflow_id = create_workflow(client)["id"]
+    start_node = create_node(client, workflow_id)
+    end_node = create_node(client, workflow_id, node_type="End")
+    edge = create_edge(client, workflow_id, start_node["id"], end_node["id"])
+    other_node = create_node(client, other_workflow_id)
+    client.post(f"/workflows/{workflow_id}/publish")
+
+    response = client.delete(f"/workflows/{workflow_id}/")
+    assert response.status_code == 200
+
+    assert client.get(f"/workflows/{workflow_id}/").status_code == 404
+    assert client.get(f"/nodes/{start_node['id']}/").status_code == 404
+    assert client.get(f"/edges/{edge['id']}/").status_code == 404
+    assert client.get(f"/workflows/{workflow_id}/versions/").json() == []
+    assert client.post(f"/workflows/{workflow_id}/run/", params={"version": 1}).status_code == 404
+    assert client.get(f"/nodes/{other_node['id']}/").status_code == 200
+
+    assert client.delete(f"/workflows/{workflow_id}/").status_code == 404
+
+
+
+def test_create_nodes_with_write_batching(monkeypatch):
+    monkeypatch.setattr(batching, "WRITE_BATCHING", True)
+    workflow_id = create_workflow(client)["id"]
+    bind = TestingSessionLocal().get_bind()
+    sqlite_statements = []
+    insert_calls = []
+
+    def trace_sqlite(dbapi_connection, connection_record):
+        dbapi_connection.set_trace_callback(sqlite_statements.append)
+
+    def trace_inserts(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO node"):
+            insert_calls.append(len(parameters) if executemany else 1)
+
+    def post_node(i):
+        return client.post(f"/workflows/{workflow_id}/nodes/", json={"type": "Message", "message": f"Batched {i}"})
+
+    # Fresh connections, so SQLite itself reports every statement it runs, including COMMITs.
+    bind.dispose()
+    event.listen(bind, "connect", trace_sqlite)
+    event.listen(bind, "before_cursor_execute", trace_inserts)
+    try:
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            responses = list(executor.map(post_node, range(40)))
+    finally:
+        event.remove(bind, "connect", trace_sqlite)
+        event.remove(bind, "before_cursor_execute", trace_inserts)
+        bind.dispose()
+
+    assert all(response.status_code == 200 for response in responses)
+    node_ids = {response.json()["id"] for response in responses}
+    assert len(node_ids) == 40
+
+    commits = [statement for statement in sqlite_statements if statement == "COMMIT"]
+    # Each batch sends all of its rows to the driver in one call.
+    assert sum(insert_calls) == 40
+    assert 0 < len(insert_calls) == len(commits) < 40
+
+    workflow = client.get(f"/workflows/{workflow_id}/").json()
+    assert {node["id"] for node in workflow["nodes"]} == node_ids
+
+
+def test_write_batcher_isolates_failing_jobs():
+    workflow_id = create_workflow(client)["id"]
+    batcher = batching.WriteBatcher(TestingSessionLocal().get_bind(), max_batch=10, max_wait=0.05)
+    valid = schemas.NodeCreate(type="Message", message="Valid")
+    invalid = schemas.NodeCreate(type="Message")
+
+    def submit(node):
+        try:
+            return batcher.submit(lambda db: WorkflowService(db, db).add_node(workflow_id, node))
+        except ValueError as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(submit, [valid, invalid, valid]))
+
+    assert isinstance(results[1], ValueError)
+    assert results[0].id != results[2].id
+    assert len(client.get(f"/workflows/{workflow_id}/").json()["nodes"]) == 2
+
+
+def test_write_batcher_isolates_failing_inserts():
+    workflow_id = create_workflow(client)["id"]
+    existing = create_node(client, workflow_id)
+    batcher = batching.WriteBatcher(TestingSessionLocal().get_bind(), max_batch=10, max_wait=0.05)
+    valid = schemas.NodeCreate(type="Message", message="Valid")
+
+    def insert(node_id):
+        row = WorkflowService.new_node(workflow_id, valid)
+        row.id = node_id
+        try:
+            return batcher.insert(row)
+        except IntegrityError as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(insert, [None, existing["id"], None]))
+
+    assert isinstance(results[1], IntegrityError)
+    assert results[0].id != results[2].id
+    assert len(client.get(f"/workflows/{workflow_id}/").json()["nodes"]) == 3
+
+
+def test_reads_use_read_only_connections():
+    workflow_id = create_workflow(client)["id"]
+    node = create_node(client, workflow_id)
+
+    with count_queries(binds=(engine,)) as write_statements, count_queries(binds=(read_engine,)) as read_statements:
+        assert client.get(f"/workflows/{workflow_id}/").status_code == 200
+        assert client.get(f"/nodes/{node['id']}/").status_code == 200
+        assert client.post(f"/workflows/{workflow_id}/run/").status_code == 200
+    assert write_statements == []
+    assert read_statements
+
+    with pytest.raises(OperationalError, match="readonly"):
+        with TestingReadSessionLocal() as db:
+            db.execute(text("DELETE FROM node"))
+
+
+def test_concurrent_runs_are_coalesced(monkeypatch):
+    workflow_id, nodes, _ = create_chain_workflow(client, 3)
+    release = threading.Event()
+    original_run_graph = services.run_graph
+
+    def blocking_run_graph(G, trace):
+        release.wait(5)
+        return original_run_graph(G, trace=trace)
+
+    monkeypatch.setattr(services, "run_graph", blocking_run_graph)
+    before = singleflight.runs.metrics()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = [executor.submit(client.post, f"/workflows/{workflow_id}/run/") for _ in range(8)]
+        deadline = time.monotonic() + 5
+        while singleflight.runs.metrics()["coalesced"] < before["coalesced"] + 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [response.result().json() for response in responses]
+
+    after = client.get("/metrics/").json()["runs"]
+    assert after["executions"] == before["executions"] + 1
+    assert after["coalesced"] == before["coalesced"] + 7
+    assert after["in_flight"] == 0
+    assert all(result == results[0] for result in results)
+    assert [step["id"] for step in results[0]["path"]] == [node["id"] for node in nodes[:-1]]
+
+
+def test_run_coalescing_key():
+    workflow_id, nodes, _ = create_chain_workflow(client, 1)
+    revision = services.draft_revision(workflow_id)
+    client.put(f"/nodes/{nodes[1]['id']}/", json={"type": "Message", "message": "edited"})
+    assert services.draft_revision(workflow_id) == revision + 1
+
+    before = singleflight.runs.metrics()
+    client.post(f"/workflows/{workflow_id}/run/")
+    client.post(f"/workflows/{workflow_id}/run/", params={"trace": True})
+    assert singleflight.runs.metrics()["executions"] == before["executions"] + 1
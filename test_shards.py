@@ -0,0 +1,154 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from db import shards
+from db.engine import read_only_url
+from db.models import Base, Edge, Node, Workflow
+from dependencies import get_read_db
+from main import app, get_db
+from services import clear_published_graph_cache
+
+
+def make_sharded_client(monkeypatch, database_url, shard_count):
+    monkeypatch.setattr(shards, "WORKFLOW_SHARDS", shard_count)
+    monkeypatch.setattr(shards, "SHARDED", True)
+
+    write_engines, read_engines = {}, {}
+    for index, shard_id in enumerate(shards.all_shards()):
+        url = shards.shard_url(database_url, index)
+        write_engines[shard_id] = create_engine(url, connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=write_engines[shard_id])
+        shards.use_immediate_transactions(write_engines[shard_id])
+        read_engines[shard_id] = create_engine(read_only_url(url), connect_args={"check_same_thread": False})
+
+    WriteSession = sessionmaker(autoflush=False, **shards.register_shards(write_engines))
+    ReadSession = sessionmaker(autoflush=False, **shards.register_shards(read_engines, writable=False))
+
+    def override(session_factory):
+        def get_session():
+            with session_factory() as db:
+                yield db
+        return get_session
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, override(WriteSession))
+    monkeypatch.setitem(app.dependency_overrides, get_read_db, override(ReadSession))
+    return TestClient(app), write_engines
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    yield f"sqlite:///{tmp_path}/workflow.db"
+    clear_published_graph_cache()
+
+
+def ids_in(engine, model):
+    with engine.connect() as conn:
+        return set(conn.execute(select(model.id)).scalars())
+
+
+def create_chain(client, size=3):
+    workflow_id = client.post("/workflows/", json={"name": "Sharded"}).json()["id"]
+    nodes = [client.post(f"/workflows/{workflow_id}/nodes/", json={"type": "Start"}).json()]
+    nodes += [
+        client.post(f"/workflows/{workflow_id}/nodes/", json={"type": "Message", "message": f"m{i}"}).json()
+        for i in range(size)
+    ]
+    nodes.append(client.post(f"/workflows/{workflow_id}/nodes/", json={"type": "End"}).json())
+    for start, end in zip(nodes, nodes[1:]):
+        response = client.post(f"/workflows/{workflow_id}/edges/",
+                               json={"start_node_id": start["id"], "end_node_id": end["id"]})
+        assert response.status_code == 200, response.text
+    return workflow_id, nodes
+
+
+def test_sharded_crud_and_run(monkeypatch, database_url):
+    client, engines = make_sharded_client(monkeypatch, database_url, 3)
+
+    workflow_ids = [create_chain(client)[0] for _ in range(12)]
+    assert len({shards.shard_for(workflow_id) for workflow_id in workflow_ids}) > 1
+
+    for shard_id, engine in engines.items():
+        workflows = ids_in(engine, Workflow)
+        assert all(shards.shard_for(workflow_id) == shard_id for workflow_id in workflows)
+        assert all(shards.shard_for(node_id) == shard_id for node_id in ids_in(engine, Node))
+        assert all(shards.shard_for(edge_id) == shard_id for edge_id in ids_in(engine, Edge))
+
+    listed = [workflow["id"] for workflow in client.get("/workflows/").json()]
+    assert listed == sorted(workflow_ids)
+    nodes = client.get("/nodes/").json()
+    assert [node["id"] for node in nodes] == sorted(node["id"] for node in nodes)
+    assert len(nodes) == 12 * 5
+
+    workflow_id, chain = create_chain(client)
+    assert client.get(f"/nodes/{chain[1]['id']}/").json()["message"] == "m0"
+    run = client.post(f"/workflows/{workflow_id}/run/").json()
+    assert [step["id"] for step in run["path"]] == [node["id"] for node in chain]
+
+    # One clone lands in another slot of the source's shard, the other on a different shard.
+    source_slot = shards.slot_for(workflow_id)
+    for clone_slot in ((source_slot + 3) % shards.SHARD_SLOTS, (source_slot + 1) % shards.SHARD_SLOTS):
+        with monkeypatch.context() as patch:
+            patch.setattr(shards.random, "randrange", lambda slots: clone_slot)
+            cloned = client.post(f"/workflows/{workflow_id}/clone").json()
+        assert shards.slot_for(cloned["id"]) == clone_slot
+        assert all(shards.slot_for(node["id"]) == clone_slot for node in cloned["nodes"])
+        assert [node["message"] for node in cloned["nodes"]] == [node["message"] for node in chain]
+        assert len(cloned["edges"]) == len(chain) - 1
+        for edge in cloned["edges"]:
+            assert shards.slot_for(edge["id"]) == clone_slot
+            assert client.get(f"/edges/{edge['id']}/").json() == edge
+        cloned_run = client.post(f"/workflows/{cloned['id']}/run/").json()
+        assert len(cloned_run["path"]) == len(chain)
+
+    assert client.delete(f"/workflows/{workflow_id}/").status_code == 200
+    assert client.get(f"/workflows/{workflow_id}/").status_code == 404
+    assert client.get(f"/workflows/{cloned['id']}/").status_code == 200
+
+
+def test_rebalance(monkeypatch, database_url):
+    client, _ = make_sharded_client(monkeypatch, database_url, 3)
+    chains = dict(create_chain(client) for _ in range(10))
+
+    result = shards.rebalance(database_url, from_shards=3, to_shards=2)
+    assert result["moved"] > 0
+
+    client, engines = make_sharded_client(monkeypatch, database_url, 2)
+    for shard_id, engine in engines.items():
+        assert all(shards.shard_for(workflow_id, 2) == shard_id for workflow_id in ids_in(engine, Workflow))
+
+    for workflow_id, chain in chains.items():
+        run = client.post(f"/workflows/{workflow_id}/run/").json()
+        assert [step["id"] for step in run["path"]] == [node["id"] for node in chain]
+
+
+def test_rebalance_renumbers_unsharded_ids(tmp_path):
+    database_url = f"sqlite:///{tmp_path}/workflow.db"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        workflows = [Workflow(name=f"w{i}") for i in range(3)]
+        db.add_all(workflows)
+        db.flush()
+        for workflow in workflows:
+            start = Node(workflow_id=workflow.id, type="Start")
+            end = Node(workflow_id=workflow.id, type="End")
+            db.add_all([start, end])
+            db.flush()
+            db.add(Edge(workflow_id=workflow.id, start_node_id=start.id, end_node_id=end.id))
+        db.commit()
+    engine.dispose()
+
+    result = shards.rebalance(database_url, from_shards=1, to_shards=2)
+
+    assert result["moved"] + result["renumbered"] == 3
+    for index in range(2):
+        shard_engine = create_engine(shards.shard_url(database_url, index))
+        with shard_engine.connect() as conn:
+            for edge in conn.execute(select(Edge)):
+                assert shards.slot_for(edge.id) == shards.slot_for(edge.workflow_id)
+                assert shards.slot_for(edge.start_node_id) == shards.slot_for(edge.workflow_id)
+            for node in conn.execute(select(Node)):
+                assert shards.shard_for(node.id, 2) == str(index)
+        shard_engine.dispose()
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy import event
+
+logger = logging.getLogger("workflow.trace")
+# Sampled traces are logged at INFO, which both Python's and uvicorn's default logging drop.
+# Unless the application configured this logger before importing us, write them to stderr.
+log_handler = None
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+TRACE_SAMPLE_RATE = float(os.getenv("WORKFLOW_TRACE_SAMPLE_RATE", "0"))
+
+
+class NullTrace:
+    """
+        Trace that records nothing; used when tracing is disabled.
+    """
+    enabled = False
+    sampled = False
+
+    def activate(self, *sessions):
+        return nullcontext()
+
+    def phase(self, name: str):
+        return nullcontext()
+
+    def condition(self, **details):
+        pass
+
+    def annotate(self, **details):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class RunTrace:
+    """
+        Wall time and SQL statement count per phase of a workflow run.
+    """
+    enabled = True
+
+    def __init__(self, sampled: bool = False):
+        self.sampled = sampled
+        self.sql_count = 0
+        self.phases = {}
+        self.conditions = []
+        self.details = {}
+        self._started = time.perf_counter()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.sql_count += 1
+
+    @contextmanager
+    def activate(self, *sessions):
+        """
+            Count the SQL sent by ``sessions`` on connections they begin while the block runs.
+
+            Listeners are attached to those sessions and connections only, never to the
+            Engine class, so runs that are not traced pay nothing per statement.
+        """
+        sessions = list({id(session): session for session in sessions}.values())
+        connections = []
+
+        def watch_connection(session, transaction, connection):
+            if not any(watched is connection for watched in connections):
+                event.listen(connection, "before_cursor_execute", self._count_statement)
+                connections.append(connection)
+
+        for session in sessions:
+            event.listen(session, "after_begin", watch_connection)
+        try:
+            yield self
+        finally:
+            for session in sessions:
+                event.remove(session, "after_begin", watch_connection)
+            for connection in connections:
+                event.remove(connection, "before_cursor_execute", self._count_statement)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        sql_before = self.sql_count
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(name, {"name": name, "ms": 0.0, "sql": 0, "calls": 0})
+            entry["ms"] += (time.perf_counter() - started) * 1000
+            entry["sql"] += self.sql_count - sql_before
+            entry["calls"] += 1
+
+    def condition(self, **details):
+        self.conditions.append(details)
+
+    def annotate(self, **details):
+        self.details.update(details)
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": (time.perf_counter() - self._started) * 1000,
+            "sql": self.sql_count,
+            "phases": list(self.phases.values()),
+            "conditions": self.conditions,
+            **self.details,
+        }
+
+    def log(self, workflow_id: int):
+        logger.info(json.dumps({"event": "workflow_run_trace", "workflow_id": workflow_id, **self.as_dict()}))
+
+
+def start_trace(requested: bool = False):
+    """
+        Return a RunTrace when tracing was requested or the run is sampled, else NULL_TRACE.
+    """
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if requested or sampled:
+        return RunTrace(sampled=sampled)
+    return NULL_TRACE